@@ -1,9 +1,13 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+import asyncio
+import orjson
+from fastapi import APIRouter, BackgroundTasks, HTTPException
+from fastapi.responses import Response, StreamingResponse
+from typing import AsyncIterator, List, Optional
 from datetime import datetime
 
 from models.schemas import ChatRequest, ChatResponse, Source, Message, ChatHistory
 from services.rag import rag_pipeline
+from services.text_processor import text_processor
 from core.cache import cache_manager
 from repositories.mongo_repo import query_repo
 from loguru import logger
@@ -11,70 +15,214 @@ from loguru import logger
 
 router = APIRouter()
 
-# Import voice routes to register them with this router
-from api.routes import voice  # noqa: F401, E402
+
+def build_chat_response(data: dict, cached: bool = True, **extra) -> ChatResponse:
+    """Build a response from already-validated cache data, skipping validation"""
+    return ChatResponse.model_construct(
+        response=data['response'],
+        sources=[Source.model_construct(**s) for s in data['sources']],
+        confidence=data['confidence'],
+        cached=cached,
+        **extra
+    )
+
+
+def cache_entry(response: ChatResponse) -> dict:
+    """Serialize a response the way it is returned on a cache hit"""
+    return response.model_copy(
+        update={'cached': True, 'transcribed_query': None, 'audio_url': None}
+    ).model_dump()
+
+
+async def save_query_background(**kwargs) -> None:
+    """Save a query off the request path, logging instead of raising"""
+    try:
+        await query_repo.save_query(**kwargs)
+    except Exception as e:
+        logger.error(f"✗ Background query save failed: {e}")
+
+
+async def persist_turn_background(
+    query_doc: dict,
+    cache_data: Optional[dict] = None,
+    embedding: Optional[List[float]] = None
+) -> None:
+    """Save a chat turn and cache its response concurrently"""
+    tasks = [save_query_background(**query_doc)]
+    if cache_data is not None:
+        tasks.append(cache_manager.set(
+            query_doc['user_query'], cache_data, query_doc['session_id'], embedding
+        ))
+    await asyncio.gather(*tasks)
 
 
 @router.post("/text", response_model=ChatResponse)
-async def chat_text(request: ChatRequest):
+async def chat_text(request: ChatRequest, background_tasks: BackgroundTasks):
     """
     Handle text-based chat queries
     
     Flow:
     1. Check cache
     2. If miss, run RAG pipeline
-    3. Save to MongoDB
-    4. Cache result
-    5. Return response
+    3. Return response
+    4. Save to MongoDB and cache result in the background
     """
     try:
         logger.info(f"Text chat request: {request.query[:100]}")
         
-        # Check cache first
-        cached_response = await cache_manager.get(request.query, request.session_id)
+        # Check cache first; hits are stored in wire format and sent as-is
+        cached_raw = await cache_manager.get_raw(request.query, request.session_id)
         
-        if cached_response:
+        if cached_raw:
             logger.info("⚡ Returning cached response")
-            return ChatResponse(
-                response=cached_response['response'],
-                sources=cached_response['sources'],
-                confidence=cached_response['confidence'],
-                cached=True
-            )
+            return Response(content=cached_raw, media_type="application/json")
         
-        # RAG pipeline
-        rag_result = await rag_pipeline.query(request.query)
+        # Coalesce concurrent misses so only one RAG run happens per query
+        async with cache_manager.lock(request.query, request.session_id):
+            cached_response = await cache_manager.get(request.query, request.session_id)
+            
+            if cached_response:
+                logger.info("⚡ Returning coalesced cached response")
+                return build_chat_response(cached_response)
+            
+            # Near-duplicate queries share a semantic cache entry
+            query_embedding = await asyncio.to_thread(text_processor.create_embedding, request.query)
+            cached_response = await cache_manager.get_similar(query_embedding, request.session_id)
+            
+            if cached_response:
+                logger.info("⚡ Returning semantically cached response")
+                return build_chat_response(cached_response)
+            
+            # RAG pipeline
+            rag_result = await rag_pipeline.query(request.query, query_embedding=query_embedding)
+            
+            # Prepare response
+            response = ChatResponse(
+                response=rag_result['response'],
+                sources=rag_result['sources'],
+                confidence=rag_result['confidence'],
+                cached=False
+            )
+            
+            # Cache the response
+            cache_data = cache_entry(response)
+            cache_manager.set_local(request.query, cache_data, request.session_id)
+            
+            # Save to MongoDB and Redis after the response is sent
+            background_tasks.add_task(
+                persist_turn_background,
+                {
+                    'session_id': request.session_id,
+                    'user_query': request.query,
+                    'response': response.response,
+                    'sources': cache_data['sources'],
+                    'confidence': response.confidence,
+                    'cached': False
+                },
+                cache_data,
+                query_embedding
+            )
+            
+            return response
         
-        # Prepare response
-        response = ChatResponse(
-            response=rag_result['response'],
-            sources=rag_result['sources'],
-            confidence=rag_result['confidence'],
-            cached=False
-        )
+    except Exception as e:
+        logger.error(f"✗ Text chat failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def ndjson_event(event: dict) -> bytes:
+    """Serialize a stream event as one line of newline-delimited JSON"""
+    return orjson.dumps(event) + b"\n"
+
+
+async def cached_events(data: dict) -> AsyncIterator[bytes]:
+    """Replay a cached response as stream events"""
+    yield ndjson_event({'type': 'sources', 'sources': data['sources'], 'confidence': data['confidence']})
+    yield ndjson_event({'type': 'delta', 'delta': data['response']})
+    yield ndjson_event({'type': 'done', 'response': data['response'], 'confidence': data['confidence'], 'cached': True})
+
+
+async def rag_events(request: ChatRequest, query_embedding: List[float]) -> AsyncIterator[bytes]:
+    """Stream RAG events, then cache and save the completed turn"""
+    sources = []
+    done = None
+    
+    try:
+        async for event in rag_pipeline.query_stream(request.query, query_embedding=query_embedding):
+            if event['type'] == 'sources':
+                sources = [s.model_dump() for s in event['sources']]
+                yield ndjson_event({**event, 'sources': sources})
+            elif event['type'] == 'delta':
+                yield ndjson_event(event)
+            else:
+                done = event
+                yield ndjson_event({
+                    'type': 'done',
+                    'response': event['response'],
+                    'confidence': event['confidence'],
+                    'cached': False
+                })
+    
+    except Exception as e:
+        logger.error(f"✗ Text chat stream failed: {e}")
+        yield ndjson_event({'type': 'error', 'detail': str(e)})
+        return
+    
+    if done is None:
+        return
+    
+    # The client already has the full response; persist before closing the stream
+    cache_data = None
+    if 'error' not in done:
+        cache_data = cache_entry(build_chat_response(
+            {'response': done['response'], 'sources': sources, 'confidence': done['confidence']}
+        ))
+        cache_manager.set_local(request.query, cache_data, request.session_id)
+    
+    await persist_turn_background(
+        {
+            'session_id': request.session_id,
+            'user_query': request.query,
+            'response': done['response'],
+            'sources': sources,
+            'confidence': done['confidence'],
+            'cached': False
+        },
+        cache_data,
+        query_embedding
+    )
+
+
+@router.post("/text/stream")
+async def chat_text_stream(request: ChatRequest):
+    """
+    Handle text-based chat queries, streaming the response as it is generated
+    
+    Returns newline-delimited JSON events:
+    1. sources - retrieved sources and confidence
+    2. delta - a piece of the response text (repeated)
+    3. done - the full response, once generation finishes
+    """
+    try:
+        logger.info(f"Text chat stream request: {request.query[:100]}")
         
-        # Save to MongoDB
-        await query_repo.save_query(
-            session_id=request.session_id,
-            user_query=request.query,
-            response=response.response,
-            sources=[s.dict() for s in response.sources],
-            confidence=response.confidence,
-            cached=False
-        )
+        # Check cache first, falling back to near-duplicate queries
+        query_embedding = None
+        cached_response = await cache_manager.get(request.query, request.session_id)
+        if not cached_response:
+            query_embedding = await asyncio.to_thread(text_processor.create_embedding, request.query)
+            cached_response = await cache_manager.get_similar(query_embedding, request.session_id)
         
-        # Cache the response
-        cache_data = {
-            'response': response.response,
-            'sources': [s.dict() for s in response.sources],
-            'confidence': response.confidence
-        }
-        await cache_manager.set(request.query, cache_data, request.session_id)
+        if cached_response:
+            logger.info("⚡ Streaming cached response")
+            events = cached_events(cached_response)
+        else:
+            events = rag_events(request, query_embedding)
         
-        return response
+        return StreamingResponse(events, media_type="application/x-ndjson")
         
     except Exception as e:
-        logger.error(f"✗ Text chat failed: {e}")
+        logger.error(f"✗ Text chat stream failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
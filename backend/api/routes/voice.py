@@ -1,21 +1,39 @@
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException
-import os
-import uuid
+from fastapi import APIRouter, BackgroundTasks, File, UploadFile, Form, HTTPException
+import asyncio
+import re
+from io import BytesIO
 from loguru import logger
 
 from models.schemas import ChatResponse
 from services.rag import rag_pipeline
 from services.voice import voice_service
+from services.text_processor import text_processor
 from core.cache import cache_manager
-from repositories.mongo_repo import query_repo
+from config import settings
+from api.routes.chat import build_chat_response, cache_entry, persist_turn_background
 
 
-# Add voice endpoint to chat router
-from api.routes.chat import router
+router = APIRouter()
+
+
+# Read uploads in 1 MB chunks to keep memory bounded
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Synthesized audio files are named by the xxh3-128 hash of their text
+AUDIO_FILE_PATTERN = re.compile(r"[0-9a-f]{32}\.(wav|mp3)")
+
+
+def render_speech_background(text: str, audio_url: str) -> None:
+    """Synthesize response audio off the request path, logging instead of raising"""
+    try:
+        voice_service.render_speech(text, audio_url)
+    except Exception as e:
+        logger.error(f"✗ Background TTS failed: {e}")
 
 
 @router.post("/voice", response_model=ChatResponse)
 async def chat_voice(
+    background_tasks: BackgroundTasks,
     audio_file: UploadFile = File(...),
     session_id: str = Form(...)
 ):
@@ -23,92 +41,110 @@ async def chat_voice(
     Handle voice-based chat queries
     
     Flow:
-    1. Save uploaded audio
+    1. Read uploaded audio into memory
     2. Transcribe with Whisper
     3. Check cache with transcribed text
     4. Run RAG if cache miss
-    5. Generate audio response with TTS
-    6. Return response with audio URL
+    5. Return response with the URL the TTS audio will be served from
+    6. Synthesize audio, save to MongoDB and cache result in the background
     """
-    temp_audio_path = None
-    
     try:
         logger.info(f"Voice chat request from session: {session_id}")
         
-        # Validate file
+        # Validate file before reading it
         if not audio_file.content_type.startswith('audio/'):
             raise HTTPException(status_code=400, detail="Invalid audio file")
         
-        # Save uploaded audio temporarily
-        temp_audio_path = f"temp/{uuid.uuid4()}_{audio_file.filename}"
-        os.makedirs("temp", exist_ok=True)
-        
-        with open(temp_audio_path, "wb") as f:
-            content = await audio_file.read()
-            f.write(content)
+        if audio_file.size is not None and audio_file.size > settings.MAX_AUDIO_BYTES:
+            raise HTTPException(status_code=413, detail="Audio file too large")
         
-        logger.info(f"✓ Audio saved: {temp_audio_path}")
+        # Buffer the (size-capped) upload in memory; Whisper decodes it in-process
+        # with PyAV, so nothing is written to disk
+        audio_data = BytesIO()
+        while chunk := await audio_file.read(UPLOAD_CHUNK_SIZE):
+            if audio_data.tell() + len(chunk) > settings.MAX_AUDIO_BYTES:
+                raise HTTPException(status_code=413, detail="Audio file too large")
+            audio_data.write(chunk)
+        audio_data.seek(0)
         
-        # Transcribe audio to text
-        transcription = voice_service.transcribe_audio(temp_audio_path)
+        # Transcribe audio to text off the event loop
+        transcription = await asyncio.to_thread(voice_service.transcribe_audio, audio_data)
         transcribed_query = transcription['text']
         
         logger.info(f"✓ Transcribed: {transcribed_query}")
         
-        # Check cache
+        # Check cache, falling back to near-duplicate queries
+        query_embedding = None
         cached_response = await cache_manager.get(transcribed_query, session_id)
+        if not cached_response:
+            query_embedding = await asyncio.to_thread(text_processor.create_embedding, transcribed_query)
+            cached_response = await cache_manager.get_similar(query_embedding, session_id)
         
         if cached_response:
             logger.info("⚡ Using cached response")
-            text_response = cached_response['response']
-            sources = cached_response['sources']
-            confidence = cached_response['confidence']
+            response_data = cached_response
             is_cached = True
+            cache_data = None
         else:
             # Run RAG pipeline
-            rag_result = await rag_pipeline.query(transcribed_query)
+            rag_result = await rag_pipeline.query(transcribed_query, query_embedding=query_embedding)
             
-            text_response = rag_result['response']
-            sources = rag_result['sources']
-            confidence = rag_result['confidence']
+            response_data = {
+                'response': rag_result['response'],
+                'sources': [s.model_dump() for s in rag_result['sources']],
+                'confidence': rag_result['confidence']
+            }
             is_cached = False
             
-            # Cache the result
-            cache_data = {
-                'response': text_response,
-                'sources': [s.dict() for s in sources],
-                'confidence': confidence
-            }
-            await cache_manager.set(transcribed_query, cache_data, session_id)
+            # Cache the result (Redis write happens after the response is sent)
+            cache_data = cache_entry(build_chat_response(response_data))
+            cache_manager.set_local(transcribed_query, cache_data, session_id)
         
-        # Generate audio response
-        audio_url = voice_service.text_to_speech(text_response, session_id)
+        text_response = response_data['response']
+        
+        # Return the audio URL now and synthesize after the response is sent;
+        # the client polls the audio status endpoint until the file is ready
+        audio_url = voice_service.speech_url(text_response)
+        if voice_service.audio_status(audio_url) == "failed":
+            logger.warning("⚠ Speech synthesis failed recently for this reply, returning no audio")
+            audio_url = None
+        else:
+            background_tasks.add_task(render_speech_background, text_response, audio_url)
         
-        # Save to MongoDB
-        await query_repo.save_query(
-            session_id=session_id,
-            user_query=transcribed_query,
-            response=text_response,
-            sources=[s.dict() for s in sources] if not is_cached else sources,
-            confidence=confidence,
-            cached=is_cached
+        # Save to MongoDB and Redis concurrently after the response is sent
+        background_tasks.add_task(
+            persist_turn_background,
+            {
+                'session_id': session_id,
+                'user_query': transcribed_query,
+                'response': text_response,
+                'sources': response_data['sources'],
+                'confidence': response_data['confidence'],
+                'cached': is_cached
+            },
+            cache_data,
+            query_embedding
         )
         
-        return ChatResponse(
-            response=text_response,
-            sources=sources,
-            confidence=confidence,
+        return build_chat_response(
+            response_data,
             cached=is_cached,
             transcribed_query=transcribed_query,
             audio_url=audio_url
         )
         
+    except HTTPException:
+        raise
+    
     except Exception as e:
         logger.error(f"✗ Voice chat failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/voice/audio/{file_name}")
+async def voice_audio_status(file_name: str):
+    """Report whether a reply's audio is ready, still being synthesized, or failed"""
+    if not AUDIO_FILE_PATTERN.fullmatch(file_name):
+        raise HTTPException(status_code=404, detail="Unknown audio file")
     
-    finally:
-        # Cleanup temp audio file
-        if temp_audio_path and os.path.exists(temp_audio_path):
-            os.remove(temp_audio_path)
-            logger.info(f"✓ Cleaned up temp file: {temp_audio_path}")
+    return {'status': voice_service.audio_status(f"/static/audio/{file_name}")}
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from typing import Optional
+from pathlib import Path
 import os
 
 
@@ -12,17 +13,35 @@ class Settings(BaseSettings):
     PINECONE_API_KEY: str
     PINECONE_ENVIRONMENT: str
     PINECONE_INDEX_NAME: str = "medical-chatbot"
+    PINECONE_UPSERT_BATCH_SIZE: int = 64
+    PINECONE_UPSERT_CONCURRENCY: int = 30
+    PINECONE_QUERY_CONCURRENCY: int = 10
+    PINECONE_UPSERT_GROUP_SIZE: int = 1000
+    PINECONE_INT8_VALUES: bool = True  # shrinks JSON bodies; ignored over gRPC
+    PINECONE_USE_GRPC: bool = True  # protobuf data plane instead of JSON over HTTP
+    PINECONE_INDEX_READY_TIMEOUT: float = 300.0
     
     # MongoDB Configuration
     MONGODB_URL: str = "mongodb://localhost:27017"
     MONGODB_DB_NAME: str = "medical_chatbot"
+    MONGO_INSERT_BATCH_SIZE: int = 50
+    MONGO_FLUSH_INTERVAL: float = 0.2
+    MONGO_MAX_BUFFERED: int = 5000  # queued queries kept while writes are failing
+    MONGO_BULK_BATCH_SIZE: int = 100
     
     # Redis Configuration
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
     REDIS_DB: int = 0
     REDIS_PASSWORD: Optional[str] = None
+    REDIS_MAX_CONNECTIONS: int = 50
     CACHE_TTL: int = 3600
+    LOCAL_CACHE_MAXSIZE: int = 1024
+    LOCAL_CACHE_TTL: int = 60
+    SEMANTIC_CACHE_BITS: int = 16
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+    SEARCH_CACHE_MAXSIZE: int = 1024
+    SEARCH_CACHE_THRESHOLD: float = 0.95
     
     # Application Settings
     APP_NAME: str = "Medical Assistant Chatbot"
@@ -32,17 +51,33 @@ class Settings(BaseSettings):
     
     # Voice Settings
     WHISPER_MODEL: str = "base"
+    WHISPER_NUM_WORKERS: int = 4
+    WHISPER_WARMUP: bool = True
     TTS_MODEL: str = "tts_models/en/ljspeech/tacotron2-DDC"
+    USE_LOCAL_TTS: bool = True
+    PIPER_VOICE_PATH: Path = Path("models/en_US-lessac-medium.onnx")
+    AUDIO_CACHE_MAX_FILES: int = 1000
+    AUDIO_FAILURE_TTL: int = 300  # seconds a failed synthesis is remembered
+    MAX_AUDIO_BYTES: int = 25 * 1024 * 1024
+    
+    # Scraper Settings
+    SCRAPE_CACHE_DIR: Path = Path("cache/http")
+    SCRAPE_CACHE_TTL: int = 30 * 24 * 3600
+    EMBEDDING_CACHE_PATH: Path = Path("cache/embeddings.db")
     
     # RAG Settings
-    CHUNK_SIZE: int = 2000
-    CHUNK_OVERLAP: int = 200
+    CHUNK_SIZE: int = 254  # tokens
+    CHUNK_OVERLAP: int = 32  # tokens
     TOP_K_RESULTS: int = 5
     CONFIDENCE_THRESHOLD: float = 0.6
+    EMBEDDING_INT8: bool = True
+    EMBEDDING_BACKEND: str = "torch"  # "onnx" runs a pre-quantized int8 export on CPU
+    EMBEDDING_ONNX_FILE: str = "onnx/model_qint8_avx512_vnni.onnx"
     
     # Server Settings
     HOST: str = "0.0.0.0"
     PORT: int = 8000
+    WORKERS: int = max(2, os.cpu_count() or 1)
     
     class Config:
         # Look for .env file in project root (parent directory)
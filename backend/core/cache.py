@@ -1,32 +1,88 @@
-import hashlib
-import json
-from typing import Optional, Any
+import asyncio
+import weakref
+import numpy as np
+import orjson
+import xxhash
+import zstandard as zstd
+from cachetools import TTLCache
+from typing import List, Optional, Any
 from core.database import redis_client
 from config import settings
 from loguru import logger
 
 
+# Prefix marking zstd-compressed payloads; plain JSON entries have none
+ZSTD_MAGIC = b"\x01"
+
+
 class CacheManager:
     """Manages Redis caching for queries and responses"""
     
     def __init__(self):
         self.ttl = settings.CACHE_TTL
+        
+        # In-process tier checked before Redis
+        self._local = TTLCache(
+            maxsize=settings.LOCAL_CACHE_MAXSIZE,
+            ttl=min(self.ttl, settings.LOCAL_CACHE_TTL)
+        )
+        
+        # Per-key locks used to coalesce concurrent misses
+        self._locks = weakref.WeakValueDictionary()
+        
+        self._cctx = zstd.ZstdCompressor(level=3)
+        self._dctx = zstd.ZstdDecompressor()
+    
+    def _encode(self, value: Any) -> bytes:
+        """Serialize and compress a value for Redis"""
+        return ZSTD_MAGIC + self._cctx.compress(orjson.dumps(value))
+    
+    def _decompress(self, raw: bytes) -> bytes:
+        """Decompress a value read from Redis into JSON bytes"""
+        if raw[:1] == ZSTD_MAGIC:
+            return self._dctx.decompress(raw[1:])
+        return raw
+    
+    def _decode(self, raw: bytes) -> Any:
+        """Decompress and deserialize a value read from Redis"""
+        return orjson.loads(self._decompress(raw))
     
     @staticmethod
     def _generate_key(query: str, session_id: str = "") -> str:
         """Generate cache key from query"""
         content = f"{query.lower().strip()}:{session_id}"
-        return f"chat:{hashlib.md5(content.encode()).hexdigest()}"
+        return f"chat:{xxhash.xxh3_64_hexdigest(content.encode())}"
+    
+    @staticmethod
+    def _session_key(session_id: str) -> str:
+        """Key of the set indexing a session's cache entries"""
+        return f"chat:session:{session_id}"
+    
+    @staticmethod
+    def _generate_semantic_key(embedding: List[float], session_id: str = "") -> str:
+        """Generate bucket key shared by queries with similar embeddings"""
+        signs = np.asarray(embedding[:settings.SEMANTIC_CACHE_BITS]) > 0
+        bucket = np.packbits(signs).tobytes()
+        content = bucket + f":{session_id}".encode()
+        return f"chat:sem:{xxhash.xxh3_64_hexdigest(content)}"
     
     async def get(self, query: str, session_id: str = "") -> Optional[dict]:
         """Retrieve cached response"""
         try:
             key = self._generate_key(query, session_id)
+            
+            local = self._local.get(key)
+            if local is not None:
+                logger.info(f"Local cache HIT for query: {query[:50]}...")
+                return local
+            
             cached = await redis_client.client.get(key)
             
             if cached:
                 logger.info(f"Cache HIT for query: {query[:50]}...")
-                return json.loads(cached)
+                response = self._decode(cached)
+                self._local[key] = response
+                return response
             
             logger.info(f"Cache MISS for query: {query[:50]}...")
             return None
@@ -35,15 +91,101 @@ class CacheManager:
             logger.error(f"Cache get error: {e}")
             return None
     
-    async def set(self, query: str, response: dict, session_id: str = "") -> bool:
-        """Store response in cache"""
+    async def get_raw(self, query: str, session_id: str = "") -> Optional[bytes]:
+        """Retrieve cached response as serialized JSON bytes"""
         try:
             key = self._generate_key(query, session_id)
-            await redis_client.client.setex(
-                key,
-                self.ttl,
-                json.dumps(response)
+            
+            local = self._local.get(key)
+            if local is not None:
+                logger.info(f"Local cache HIT for query: {query[:50]}...")
+                return orjson.dumps(local)
+            
+            cached = await redis_client.client.get(key)
+            
+            if cached:
+                logger.info(f"Cache HIT for query: {query[:50]}...")
+                raw = self._decompress(cached)
+                self._local[key] = orjson.loads(raw)
+                return raw
+            
+            logger.info(f"Cache MISS for query: {query[:50]}...")
+            return None
+            
+        except Exception as e:
+            logger.error(f"Cache get error: {e}")
+            return None
+    
+    async def get_similar(
+        self,
+        embedding: List[float],
+        session_id: str = ""
+    ) -> Optional[dict]:
+        """Retrieve cached response for a semantically similar query"""
+        try:
+            entry = await redis_client.client.get(
+                self._generate_semantic_key(embedding, session_id)
+            )
+            if not entry:
+                return None
+            
+            entry = self._decode(entry)
+            
+            # Revalidate the bucket match before serving it
+            query_vec = np.asarray(embedding)
+            cached_vec = np.asarray(entry['embedding'])
+            similarity = float(query_vec @ cached_vec) / (
+                np.linalg.norm(query_vec) * np.linalg.norm(cached_vec) or 1.0
             )
+            if similarity < settings.SEMANTIC_CACHE_THRESHOLD:
+                return None
+            
+            cached = self._local.get(entry['key'])
+            if cached is None:
+                cached = await redis_client.client.get(entry['key'])
+                if not cached:
+                    return None
+                cached = self._decode(cached)
+            
+            logger.info(f"Semantic cache HIT (similarity: {similarity:.3f})")
+            return cached
+            
+        except Exception as e:
+            logger.error(f"Semantic cache get error: {e}")
+            return None
+    
+    async def set(
+        self,
+        query: str,
+        response: dict,
+        session_id: str = "",
+        embedding: Optional[List[float]] = None
+    ) -> bool:
+        """Store response in cache"""
+        try:
+            key = self._generate_key(query, session_id)
+            self._local[key] = response
+            
+            # Write the entry, its semantic bucket and session index in one round trip
+            pipe = redis_client.pipeline()
+            pipe.setex(key, self.ttl, self._encode(response))
+            keys = [key]
+            
+            if embedding is not None:
+                semantic_key = self._generate_semantic_key(embedding, session_id)
+                pipe.setex(
+                    semantic_key,
+                    self.ttl,
+                    self._encode({'key': key, 'embedding': embedding})
+                )
+                keys.append(semantic_key)
+            
+            if session_id:
+                session_key = self._session_key(session_id)
+                pipe.sadd(session_key, *keys)
+                pipe.expire(session_key, self.ttl)
+            
+            await pipe.execute()
             logger.info(f"Cached response for: {query[:50]}...")
             return True
             
@@ -51,17 +193,33 @@ class CacheManager:
             logger.error(f"Cache set error: {e}")
             return False
     
+    def set_local(self, query: str, response: dict, session_id: str = "") -> None:
+        """Store response in the in-process tier only"""
+        self._local[self._generate_key(query, session_id)] = response
+    
+    def lock(self, query: str, session_id: str = "") -> asyncio.Lock:
+        """Get the lock guarding computation of a query's response"""
+        key = self._generate_key(query, session_id)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+    
     async def clear_session(self, session_id: str) -> bool:
         """Clear all cache for a session"""
         try:
-            pattern = f"chat:*:{session_id}"
-            keys = await redis_client.client.keys(pattern)
-            if keys:
-                await redis_client.client.delete(*keys)
+            session_key = self._session_key(session_id)
+            keys = await redis_client.client.smembers(session_key)
+            
+            for key in keys:
+                self._local.pop(key.decode(), None)
+            
+            # UNLINK frees memory in the background instead of blocking Redis
+            await redis_client.client.unlink(*keys, session_key)
             return True
         except Exception as e:
             logger.error(f"Cache clear error: {e}")
             return False
 
-
 cache_manager = CacheManager()
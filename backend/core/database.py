@@ -1,5 +1,6 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from redis.asyncio import Redis
+from typing import List, Optional
+from redis.asyncio import ConnectionPool, Redis
 from config import settings
 from loguru import logger
 
@@ -13,6 +14,8 @@ class MongoDB:
     
     def connect(self):
         """Initialize MongoDB connection"""
+        if self.client:
+            return
         self.client = AsyncIOMotorClient(settings.MONGODB_URL)
         self.db = self.client[settings.MONGODB_DB_NAME]
         logger.info("MongoDB connection initialized")
@@ -21,8 +24,20 @@ class MongoDB:
         """Close MongoDB connection"""
         if self.client:
             self.client.close()
+            self.client = None
+            self.db = None
             logger.info("MongoDB connection closed")
     
+    async def create_indexes(self):
+        """Create indexes used by query history and document lookups"""
+        try:
+            await self.db.queries.create_index([("session_id", 1), ("timestamp", 1)])
+            await self.db.documents.create_index([("topic", 1)])
+            await self.db.documents.create_index([("doc_id", 1)], unique=True)
+            logger.info("MongoDB indexes ensured")
+        except Exception as e:
+            logger.warning(f"MongoDB index creation failed: {e}")
+    
     async def get_queries_collection(self):
         """Get queries collection"""
         return self.db.queries
@@ -36,23 +51,28 @@ class RedisCache:
     """Redis connection manager"""
     
     def __init__(self):
+        self.pool: ConnectionPool = None
         self.client: Redis = None
     
     async def connect(self):
-        """Initialize Redis connection"""
-        self.client = Redis(
+        """Initialize Redis connection pool"""
+        self.pool = ConnectionPool(
             host=settings.REDIS_HOST,
             port=settings.REDIS_PORT,
             db=settings.REDIS_DB,
             password=settings.REDIS_PASSWORD,
-            decode_responses=True
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            health_check_interval=30,
+            socket_keepalive=True
         )
+        self.client = Redis(connection_pool=self.pool)
         logger.info("Redis connection initialized")
     
     async def close(self):
-        """Close Redis connection"""
+        """Close Redis connection pool"""
         if self.client:
-            await self.client.close()
+            await self.client.aclose()
+            await self.pool.disconnect()
             logger.info("Redis connection closed")
     
     async def ping(self):
@@ -60,10 +80,19 @@ class RedisCache:
         if not self.client:
             await self.connect()
         return await self.client.ping()
+    
+    async def mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        """Fetch several keys in one round trip"""
+        if not keys:
+            return []
+        return await self.client.mget(keys)
+    
+    def pipeline(self, transaction: bool = False):
+        """Batch multiple commands into one round trip"""
+        return self.client.pipeline(transaction=transaction)
 
 
 # Singleton instances
 mongodb_client = MongoDB()
-mongodb_client.connect()
 
 redis_client = RedisCache()
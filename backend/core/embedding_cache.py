@@ -0,0 +1,61 @@
+import sqlite3
+import threading
+import numpy as np
+import xxhash
+from pathlib import Path
+from typing import Dict, List
+from loguru import logger
+
+
+# Stay under SQLite's default limit on host parameters per statement
+_LOOKUP_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+    """Content-addressed on-disk store of text embeddings"""
+    
+    def __init__(self, path: Path, namespace: str = ""):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        
+        # Embeddings from a different model or precision must not be reused
+        self.namespace = namespace
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (hash BLOB PRIMARY KEY, vec BLOB NOT NULL)"
+        )
+        self._conn.commit()
+        logger.info(f"✓ Embedding cache opened: {self.path}")
+    
+    def key(self, text: str) -> bytes:
+        """Generate the content address for a text"""
+        return xxhash.xxh3_128_digest(f"{self.namespace}\0{text}".encode())
+    
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Look up embeddings for many keys, returning only the hits"""
+        hits = {}
+        with self._lock:
+            for i in range(0, len(keys), _LOOKUP_BATCH_SIZE):
+                batch = keys[i:i + _LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE hash IN ({placeholders})", batch
+                )
+                for key, vec in rows:
+                    hits[key] = np.frombuffer(vec, dtype=np.float32)
+        
+        return hits
+    
+    def put_many(self, items: Dict[bytes, np.ndarray]):
+        """Store embeddings by key"""
+        rows = [(key, np.asarray(vec, dtype=np.float32).tobytes()) for key, vec in items.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", rows)
+            self._conn.commit()
+    
+    def close(self):
+        """Close the underlying database"""
+        with self._lock:
+            self._conn.close()
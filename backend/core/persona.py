@@ -1,5 +1,7 @@
 """Digital Twin - Dr. Asha Medical Assistant Persona"""
 
+import ahocorasick
+
 
 SYSTEM_PROMPT = """You are Dr. Asha, a virtual medical assistant designed to provide accurate, evidence-based medical information.
 
@@ -28,9 +30,6 @@ Remember: You are an educational assistant providing medical information. Be tho
 """
 
 
-RESPONSE_TEMPLATE = """{response}"""
-
-
 CHAIN_OF_THOUGHT_PROMPT = """You are Dr. Asha, a knowledgeable medical assistant. Answer the question using the provided context.
 
 Context from medical sources:
@@ -58,29 +57,37 @@ DISCLAIMER_MESSAGES = {
 }
 
 
+EMERGENCY_KEYWORDS = (
+    "chest pain", "heart attack", "stroke", "can't breathe",
+    "severe bleeding", "unconscious", "suicide", "overdose",
+    "severe pain", "emergency", "dying"
+)
+
+# Aho-Corasick automaton matches every keyword in one linear pass over the lowercased query
+_EMERGENCY_AUTOMATON = ahocorasick.Automaton()
+for _keyword in EMERGENCY_KEYWORDS:
+    _EMERGENCY_AUTOMATON.add_word(_keyword, _keyword)
+_EMERGENCY_AUTOMATON.make_automaton()
+
+LOW_CONFIDENCE_PREFIX = f"{DISCLAIMER_MESSAGES['low_confidence']}\n\n"
+
+_EMERGENCY_RESPONSE = f"{DISCLAIMER_MESSAGES['emergency']}\n\nI'm designed to provide general medical information, not emergency assistance. Your safety is the top priority."
+
+
 def format_response(raw_response: str, confidence: float = 1.0) -> str:
     """Format response with Dr. Asha persona"""
-    formatted = RESPONSE_TEMPLATE.format(response=raw_response)
-    
     # Add low confidence warning only for very low confidence
     if confidence < 0.5:
-        formatted = f"{DISCLAIMER_MESSAGES['low_confidence']}\n\n{formatted}"
+        return LOW_CONFIDENCE_PREFIX + raw_response
     
-    return formatted
+    return raw_response
 
 
 def detect_emergency_keywords(query: str) -> bool:
     """Detect emergency situations"""
-    emergency_keywords = [
-        "chest pain", "heart attack", "stroke", "can't breathe",
-        "severe bleeding", "unconscious", "suicide", "overdose",
-        "severe pain", "emergency", "dying"
-    ]
-    
-    query_lower = query.lower()
-    return any(keyword in query_lower for keyword in emergency_keywords)
+    return next(_EMERGENCY_AUTOMATON.iter(query.lower()), None) is not None
 
 
 def get_emergency_response() -> str:
     """Return emergency response"""
-    return f"{DISCLAIMER_MESSAGES['emergency']}\n\nI'm designed to provide general medical information, not emergency assistance. Your safety is the top priority."
+    return _EMERGENCY_RESPONSE
@@ -1,13 +1,18 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from loguru import logger
+import asyncio
 import os
 
 from config import settings
-from api.routes import chat, health
+from api.routes import chat, health, voice
 from core.database import mongodb_client, redis_client
+from repositories.mongo_repo import query_repo
+from services.vector_store import vector_db
+from services.voice import voice_service
 
 
 @asynccontextmanager
@@ -22,7 +27,9 @@ async def lifespan(app: FastAPI):
     # Test connections
     try:
         # Test MongoDB
+        mongodb_client.connect()
         await mongodb_client.db.command('ping')
+        await mongodb_client.create_indexes()
         logger.info("✓ MongoDB connected")
         
         # Test Redis
@@ -33,12 +40,24 @@ async def lifespan(app: FastAPI):
         logger.error(f"✗ Connection failed: {e}")
         raise
     
+    # Batch query history inserts
+    query_repo.start_buffer()
+    
+    # Load Whisper before serving so the first voice request doesn't pay for it
+    if settings.WHISPER_WARMUP:
+        await asyncio.to_thread(voice_service.warmup)
+    
+    # Likewise the TTS voice, which speech_url() reads on the event loop
+    await asyncio.to_thread(voice_service.preload_tts)
+    
     yield
     
     # Cleanup
     logger.info("Shutting down...")
+    await query_repo.stop_buffer()
     mongodb_client.close()
     await redis_client.close()
+    vector_db.close()
 
 
 app = FastAPI(
@@ -56,8 +75,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    """Reject oversized bodies from their Content-Length before reading them"""
+    content_length = request.headers.get("content-length")
+    # Allow 1 MB on top of the audio limit for multipart framing and form fields
+    if content_length and content_length.isdigit() and \
+            int(content_length) > settings.MAX_AUDIO_BYTES + (1 << 20):
+        return JSONResponse(status_code=413, content={"detail": "Request body too large"})
+    return await call_next(request)
+
+
 # Routes
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
+app.include_router(voice.router, prefix="/api/chat", tags=["voice"])
 app.include_router(health.router, prefix="/api", tags=["health"])
 
 # Static files (mount after routes to avoid conflicts)
@@ -69,7 +101,7 @@ else:
 
 
 @app.get("/")
-async def root():
+async def root() -> dict:
     return {
         "app": settings.APP_NAME,
         "version": settings.APP_VERSION,
@@ -83,5 +115,9 @@ if __name__ == "__main__":
         "main:app",
         host=settings.HOST,
         port=settings.PORT,
+        loop="uvloop",
+        http="httptools",
+        # Reload mode only supports a single worker
+        workers=1 if settings.DEBUG else settings.WORKERS,
         reload=settings.DEBUG
     )
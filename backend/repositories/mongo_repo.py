@@ -1,14 +1,150 @@
-from typing import List, Optional
+import asyncio
+from typing import Awaitable, Callable, List, Optional
 from datetime import datetime
+from bson import ObjectId
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
 from loguru import logger
 
+from config import settings
 from core.database import mongodb_client
 from models.database_models import QueryDocument, DocumentChunk
 
 
+# Fields needed to render chat history
+HISTORY_PROJECTION = {
+    "user_query": 1,
+    "response": 1,
+    "sources": 1,
+    "timestamp": 1,
+    "_id": 0
+}
+
+# Duplicate key: the document was written by an earlier, partly failed attempt
+DUPLICATE_KEY_ERROR = 11000
+
+# Match and sort on topic ahead of the $group so MongoDB can walk the topic
+# index in order instead of scanning every document
+TOPIC_COUNTS_PIPELINE = [
+    {"$match": {"topic": {"$ne": None}}},
+    {"$sort": {"topic": 1}},
+    {"$group": {"_id": "$topic", "count": {"$sum": 1}}},
+    {"$sort": {"count": -1}}
+]
+
+
+class BufferedInserter:
+    """Accumulates documents and writes them in batches with insert_many"""
+    
+    def __init__(
+        self,
+        get_collection: Callable[[], Awaitable],
+        batch_size: int = 50,
+        flush_interval: float = 0.2,
+        max_buffered: int = 5000
+    ):
+        self._get_collection = get_collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self._docs: List[dict] = []
+        self._full = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def start(self):
+        """Start the background flush loop"""
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+            logger.info("✓ Buffered inserter started")
+    
+    async def stop(self):
+        """Stop the flush loop and write any remaining documents"""
+        if self._task:
+            # Let the loop finish its current write rather than cancelling it mid-insert
+            self._stopping = True
+            self._full.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+        
+        if self._docs:
+            logger.error(f"✗ {len(self._docs)} queries could not be written before shutdown")
+        logger.info("✓ Buffered inserter stopped")
+    
+    def put(self, doc: dict):
+        """Queue a document for the next batch"""
+        self._docs.append(doc)
+        if len(self._docs) >= self.batch_size:
+            self._full.set()
+    
+    async def flush(self):
+        """Write all queued documents, waiting for any in-flight batch"""
+        batch, self._docs = self._docs, []
+        self._full.clear()
+        
+        async with self._write_lock:
+            if not batch:
+                return
+            try:
+                collection = await self._get_collection()
+                await collection.insert_many(batch, ordered=False)
+                logger.info(f"✓ Flushed {len(batch)} queries to DB")
+            except BulkWriteError as e:
+                # Unordered inserts write what they can; retry only the rejected documents
+                failed = {
+                    error['index'] for error in e.details.get('writeErrors', [])
+                    if error.get('code') != DUPLICATE_KEY_ERROR
+                }
+                if failed:
+                    logger.error(f"✗ Failed to flush {len(failed)} of {len(batch)} queries: {e}")
+                    self._requeue([doc for i, doc in enumerate(batch) if i in failed])
+            except Exception as e:
+                logger.error(f"✗ Failed to flush {len(batch)} queries: {e}")
+                self._requeue(batch)
+    
+    def _requeue(self, batch: List[dict]):
+        """Put a failed batch back at the front of the queue, dropping the oldest past the cap"""
+        self._docs = batch + self._docs
+        overflow = len(self._docs) - self.max_buffered
+        if overflow > 0:
+            del self._docs[:overflow]
+            logger.error(f"✗ Dropped {overflow} queued queries over the buffer limit")
+    
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+
 class QueryRepository:
     """MongoDB repository for query history"""
     
+    def __init__(self):
+        self._buffer = BufferedInserter(
+            mongodb_client.get_queries_collection,
+            batch_size=settings.MONGO_INSERT_BATCH_SIZE,
+            flush_interval=settings.MONGO_FLUSH_INTERVAL,
+            max_buffered=settings.MONGO_MAX_BUFFERED
+        )
+    
+    def start_buffer(self):
+        """Start batching query inserts"""
+        self._buffer.start()
+    
+    async def stop_buffer(self):
+        """Stop batching and flush pending query inserts"""
+        await self._buffer.stop()
+    
     async def save_query(
         self,
         session_id: str,
@@ -20,8 +156,6 @@ class QueryRepository:
     ) -> str:
         """Save query and response to database"""
         try:
-            collection = await mongodb_client.get_queries_collection()
-            
             query_doc = QueryDocument(
                 session_id=session_id,
                 user_query=user_query,
@@ -31,6 +165,13 @@ class QueryRepository:
                 cached=cached
             )
             
+            if self._buffer.running:
+                doc = query_doc.to_dict()
+                doc["_id"] = ObjectId()
+                self._buffer.put(doc)
+                return str(doc["_id"])
+            
+            collection = await mongodb_client.get_queries_collection()
             result = await collection.insert_one(query_doc.to_dict())
             logger.info(f"✓ Saved query to DB: {result.inserted_id}")
             
@@ -43,11 +184,15 @@ class QueryRepository:
     async def get_session_history(self, session_id: str) -> List[dict]:
         """Get all queries for a session"""
         try:
+            # Make sure buffered inserts are visible to the read
+            await self._buffer.flush()
+            
             collection = await mongodb_client.get_queries_collection()
             
             cursor = collection.find(
-                {"session_id": session_id}
-            ).sort("timestamp", 1)
+                {"session_id": session_id},
+                projection=HISTORY_PROJECTION
+            ).sort("timestamp", 1).batch_size(100)
             
             queries = await cursor.to_list(length=100)
             logger.info(f"✓ Retrieved {len(queries)} queries for session {session_id}")
@@ -76,8 +221,10 @@ class QueryRepository:
 class DocumentRepository:
     """MongoDB repository for medical documents"""
     
-    async def save_document_chunks(self, chunks: List[dict]) -> int:
-        """Save processed document chunks"""
+    async def save_document_chunks(self, chunks: List[dict], batch_size: int = None) -> int:
+        """Save processed document chunks (embeddings live in Pinecone only)"""
+        batch_size = batch_size or settings.MONGO_BULK_BATCH_SIZE
+        
         try:
             collection = await mongodb_client.get_documents_collection()
             
@@ -100,11 +247,23 @@ class DocumentRepository:
                 )
                 chunk_docs.append(doc_chunk.to_dict())
             
-            # Insert all chunks
-            result = await collection.insert_many(chunk_docs)
-            logger.info(f"✓ Saved {len(result.inserted_ids)} document chunks")
+            # Upsert by doc_id so pipeline re-runs don't trip the unique index,
+            # sending the batches concurrently
+            results = await asyncio.gather(*[
+                collection.bulk_write(
+                    [
+                        ReplaceOne({"doc_id": doc["doc_id"]}, doc, upsert=True)
+                        for doc in chunk_docs[i:i + batch_size]
+                    ],
+                    ordered=False
+                )
+                for i in range(0, len(chunk_docs), batch_size)
+            ])
+            
+            saved = sum(r.upserted_count + r.matched_count for r in results)
+            logger.info(f"✓ Saved {saved} document chunks in {len(results)} batches")
             
-            return len(result.inserted_ids)
+            return saved
             
         except Exception as e:
             logger.error(f"✗ Failed to save document chunks: {e}")
@@ -144,15 +303,11 @@ class DocumentRepository:
             total = await collection.count_documents({})
             
             # Get all unique topics using aggregation
-            pipeline = [
-                {"$group": {"_id": "$topic", "count": {"$sum": 1}}},
-                {"$sort": {"count": -1}}
-            ]
-            
-            cursor = collection.aggregate(pipeline)
-            results = await cursor.to_list(length=None)
-            
-            topics = {result["_id"]: result["count"] for result in results}
+            # Consume the cursor batch by batch rather than materializing it first
+            topics = {
+                result["_id"]: result["count"]
+                async for result in collection.aggregate(TOPIC_COUNTS_PIPELINE)
+            }
             
             return {
                 "total": total,
@@ -6,6 +6,7 @@ Scrapes medical articles, processes them, and indexes to Pinecone
 import asyncio
 import sys
 import os
+from typing import Dict, List
 
 # Add parent directory to path to import modules
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -15,50 +16,64 @@ from services.scraper import scrape_medical_data
 from services.text_processor import text_processor
 from services.vector_store import vector_db
 from repositories.mongo_repo import document_repo
+from core.database import mongodb_client
+from config import settings
+
+
+async def store_chunks(chunks: List[Dict]) -> int:
+    """Index a batch of chunks to Pinecone and save it to MongoDB concurrently"""
+    _, count = await asyncio.gather(
+        asyncio.to_thread(vector_db.upsert_documents, chunks),
+        document_repo.save_document_chunks(chunks)
+    )
+    return count
 
 
 async def run_data_pipeline():
     """
     Complete data pipeline:
     1. Scrape medical articles
-    2. Process and chunk text
-    3. Create embeddings
-    4. Index to Pinecone
-    5. Save to MongoDB
+    2. Set up Pinecone index
+    3. Process, chunk and embed text in batches
+    4. Index each batch to Pinecone and save it to MongoDB
+       while the next batch is being embedded
     """
     
     logger.info("=" * 60)
     logger.info("STARTING DATA PIPELINE")
     logger.info("=" * 60)
     
+    mongodb_client.connect()
+    
     # Step 1: Scrape medical data
-    logger.info("\n[1/5] Scraping medical articles...")
-    scraped_docs = scrape_medical_data()
+    logger.info("\n[1/3] Scraping medical articles...")
+    scraped_docs = await scrape_medical_data()
     logger.info(f"✓ Scraped {len(scraped_docs)} articles")
     
-    # Step 2: Process documents
-    logger.info("\n[2/5] Processing and chunking documents...")
-    all_chunks = []
-    
-    for doc in scraped_docs:
-        chunks = text_processor.process_document(doc)
-        all_chunks.extend(chunks)
-    
-    logger.info(f"✓ Created {len(all_chunks)} total chunks")
-    
-    # Step 3: Create Pinecone index
-    logger.info("\n[3/5] Setting up Pinecone index...")
+    # Step 2: Create Pinecone index
+    logger.info("\n[2/3] Setting up Pinecone index...")
     vector_db.create_index()
     logger.info("✓ Index ready")
     
-    # Step 4: Upload to Pinecone
-    logger.info("\n[4/5] Uploading embeddings to Pinecone...")
-    vector_db.upsert_documents(all_chunks)
-    logger.info("✓ Embeddings indexed")
+    # Step 3: Embed and store chunks batch by batch, so only one batch is held in memory
+    logger.info("\n[3/3] Processing, indexing and saving documents...")
+    text_processor.enable_embedding_cache(settings.EMBEDDING_CACHE_PATH)
+    batches = text_processor.stream_documents(scraped_docs)
+    pending = None
+    total_chunks = 0
+    count = 0
+    
+    while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+        if pending is not None:
+            count += await pending
+        
+        total_chunks += len(batch)
+        pending = asyncio.create_task(store_chunks(batch))
+    
+    if pending is not None:
+        count += await pending
     
-    # Step 5: Save to MongoDB
-    logger.info("\n[5/5] Saving documents to MongoDB...")
-    count = await document_repo.save_document_chunks(all_chunks)
+    logger.info(f"✓ Created {total_chunks} total chunks")
     logger.info(f"✓ Saved {count} chunks to MongoDB")
     
     # Show stats
@@ -77,6 +92,7 @@ async def run_data_pipeline():
         logger.info(f"  - {topic}: {count} chunks")
     
     logger.info("\n✓ Knowledge base ready for RAG queries!")
+    mongodb_client.close()
 
 
 if __name__ == "__main__":
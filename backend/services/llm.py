@@ -1,16 +1,28 @@
-from groq import Groq
-from typing import List, Dict, Optional
+from groq import AsyncGroq, Groq
+from typing import AsyncIterator, List, Dict, Optional
 from loguru import logger
 from config import settings
 from core.persona import CHAIN_OF_THOUGHT_PROMPT, format_response, detect_emergency_keywords, get_emergency_response
 import os
 
 
+SYSTEM_MESSAGE = "You are Dr. Asha, an empathetic and knowledgeable medical assistant. Provide detailed, accurate, evidence-based medical information. Explain concepts thoroughly and be helpful. Never diagnose or prescribe, but always provide comprehensive educational information."
+
+FALLBACK_RESPONSE = "I apologize, but I'm having trouble processing your question right now. Please try again or rephrase your question."
+
+GENERATION_PARAMS = {
+    "temperature": 0.8,
+    "max_tokens": 2048,
+    "top_p": 0.95
+}
+
+
 class Llama3LLM:
     """Llama 3 LLM integration via Groq API"""
     
     def __init__(self):
         self.client = Groq(api_key=settings.LLAMA_API_KEY)
+        self.async_client = AsyncGroq(api_key=settings.LLAMA_API_KEY)
         self.model = settings.LLAMA_MODEL
         logger.info(f"✓ Llama 3 LLM initialized (model: {self.model})")
     
@@ -30,34 +42,16 @@ class Llama3LLM:
                 'emergency': True
             }
         
-        # Prepare context
-        context_text = self._format_context(context_chunks)
-        
-        # Build prompt
-        if use_chain_of_thought:
-            prompt = CHAIN_OF_THOUGHT_PROMPT.format(
-                context=context_text,
-                question=query
-            )
-        else:
-            prompt = f"Context:\n{context_text}\n\nQuestion: {query}\n\nAnswer:"
-        
         try:
             # Generate response using Groq API with Llama 3
             response = self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are Dr. Asha, an empathetic and knowledgeable medical assistant. Provide detailed, accurate, evidence-based medical information. Explain concepts thoroughly and be helpful. Never diagnose or prescribe, but always provide comprehensive educational information."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.8,
-                max_tokens=2048,
-                top_p=0.95
+                messages=self._build_messages(query, context_chunks, use_chain_of_thought),
+                **GENERATION_PARAMS
             )
             
             # Calculate confidence based on context relevance
-            avg_score = sum(chunk['score'] for chunk in context_chunks) / len(context_chunks)
-            confidence = min(avg_score, 1.0)
+            confidence = self.compute_confidence(context_chunks)
             
             # Extract response text
             response_text = response.choices[0].message.content
@@ -75,12 +69,62 @@ class Llama3LLM:
         except Exception as e:
             logger.error(f"✗ LLM generation failed: {e}")
             return {
-                'response': "I apologize, but I'm having trouble processing your question right now. Please try again or rephrase your question.",
+                'response': FALLBACK_RESPONSE,
                 'confidence': 0.0,
                 'emergency': False,
                 'error': str(e)
             }
     
+    async def generate_response_stream(
+        self,
+        query: str,
+        context_chunks: List[Dict],
+        use_chain_of_thought: bool = True
+    ) -> AsyncIterator[str]:
+        """Stream raw response tokens as they are generated"""
+        stream = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=self._build_messages(query, context_chunks, use_chain_of_thought),
+            stream=True,
+            **GENERATION_PARAMS
+        )
+        
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    
+    @staticmethod
+    def compute_confidence(context_chunks: List[Dict]) -> float:
+        """Calculate confidence based on context relevance"""
+        # Plain float math keeps the scores' full precision for a handful of chunks
+        avg_score = sum(chunk['score'] for chunk in context_chunks) / len(context_chunks)
+        return min(avg_score, 1.0)
+    
+    def _build_messages(
+        self,
+        query: str,
+        context_chunks: List[Dict],
+        use_chain_of_thought: bool
+    ) -> List[Dict[str, str]]:
+        """Build the chat messages for a query and its context"""
+        # Prepare context
+        context_text = self._format_context(context_chunks)
+        
+        # Build prompt
+        if use_chain_of_thought:
+            prompt = CHAIN_OF_THOUGHT_PROMPT.format(
+                context=context_text,
+                question=query
+            )
+        else:
+            prompt = f"Context:\n{context_text}\n\nQuestion: {query}\n\nAnswer:"
+        
+        return [
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ]
+    
     @staticmethod
     def _format_context(chunks: List[Dict]) -> str:
         """Format context chunks for prompt"""
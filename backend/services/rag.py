@@ -1,12 +1,17 @@
-from typing import List, Dict, Optional
+import asyncio
+from typing import AsyncIterator, List, Dict, Optional
 from loguru import logger
 
 from services.text_processor import text_processor
 from services.vector_store import vector_db
-from services.llm import llm_service
+from services.llm import llm_service, FALLBACK_RESPONSE
+from core.persona import LOW_CONFIDENCE_PREFIX, detect_emergency_keywords, get_emergency_response
 from models.schemas import Source
 
 
+NO_MATCHES_RESPONSE = "I don't have specific information about that topic in my current knowledge base. My knowledge covers diabetes, hypertension, and related cardiovascular conditions. Please try asking about these topics, or consult a healthcare professional for information on other medical subjects."
+
+
 class RAGPipeline:
     """Retrieval-Augmented Generation Pipeline"""
     
@@ -17,13 +22,14 @@ class RAGPipeline:
         self,
         user_query: str,
         top_k: int = 10,
-        topic_filter: Optional[str] = None
+        topic_filter: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> Dict:
         """
         Execute RAG pipeline
         
         Flow:
-        1. Embed user query
+        1. Embed user query (unless already embedded by the caller)
         2. Search vector database
         3. Retrieve top-K chunks
         4. Generate response with LLM
@@ -36,11 +42,14 @@ class RAGPipeline:
         logger.info(f"RAG Query: {user_query[:100]}...")
         
         # Step 1: Create query embedding
-        query_embedding = text_processor.create_embedding(user_query)
-        logger.info("✓ Query embedded")
+        if query_embedding is None:
+            query_embedding = text_processor.create_embedding(user_query)
+            logger.info("✓ Query embedded")
         
-        # Step 2: Search vector database
-        matches = vector_db.search(
+        # Step 2: Search vector database off the event loop so concurrent
+        # requests overlap their Pinecone round-trips
+        matches = await asyncio.to_thread(
+            vector_db.search,
             query_embedding=query_embedding,
             top_k=top_k,
             topic_filter=topic_filter
@@ -49,7 +58,7 @@ class RAGPipeline:
         if not matches:
             logger.warning("No matches found in vector database")
             return {
-                'response': "I don't have specific information about that topic in my current knowledge base. My knowledge covers diabetes, hypertension, and related cardiovascular conditions. Please try asking about these topics, or consult a healthcare professional for information on other medical subjects.",
+                'response': NO_MATCHES_RESPONSE,
                 'sources': [],
                 'confidence': 0.0
             }
@@ -74,23 +83,92 @@ class RAGPipeline:
         logger.info(f"✓ RAG complete (confidence: {result['confidence']:.2f})")
         return result
     
+    async def query_stream(
+        self,
+        user_query: str,
+        top_k: int = 10,
+        topic_filter: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Execute RAG pipeline, streaming the response as it is generated
+        
+        Events:
+        1. {'type': 'sources', 'sources': [...], 'confidence': ...} once retrieval is done
+        2. {'type': 'delta', 'delta': ...} for each piece of response text
+        3. {'type': 'done', 'response': ..., 'confidence': ...} with the full formatted response
+        """
+        top_k = int(top_k) if top_k else 3
+        
+        logger.info(f"RAG stream query: {user_query[:100]}...")
+        
+        if query_embedding is None:
+            query_embedding = text_processor.create_embedding(user_query)
+        
+        matches = await asyncio.to_thread(
+            vector_db.search,
+            query_embedding=query_embedding,
+            top_k=top_k,
+            topic_filter=topic_filter
+        )
+        
+        if not matches:
+            logger.warning("No matches found in vector database")
+            yield {'type': 'sources', 'sources': [], 'confidence': 0.0}
+            yield {'type': 'delta', 'delta': NO_MATCHES_RESPONSE}
+            yield {'type': 'done', 'response': NO_MATCHES_RESPONSE, 'confidence': 0.0, 'emergency': False}
+            return
+        
+        sources = self._extract_sources(matches)
+        
+        if detect_emergency_keywords(user_query):
+            response = get_emergency_response()
+            yield {'type': 'sources', 'sources': sources, 'confidence': 1.0}
+            yield {'type': 'delta', 'delta': response}
+            yield {'type': 'done', 'response': response, 'confidence': 1.0, 'emergency': True}
+            return
+        
+        # Confidence only depends on retrieval, so it is known before generation starts
+        confidence = llm_service.compute_confidence(matches)
+        yield {'type': 'sources', 'sources': sources, 'confidence': confidence}
+        
+        parts = []
+        if confidence < 0.5:
+            parts.append(LOW_CONFIDENCE_PREFIX)
+            yield {'type': 'delta', 'delta': LOW_CONFIDENCE_PREFIX}
+        
+        try:
+            async for delta in llm_service.generate_response_stream(user_query, matches):
+                parts.append(delta)
+                yield {'type': 'delta', 'delta': delta}
+        
+        except Exception as e:
+            logger.error(f"✗ LLM streaming failed: {e}")
+            # Replace whatever was streamed so far with the fallback message
+            yield {'type': 'done', 'response': FALLBACK_RESPONSE, 'confidence': 0.0, 'emergency': False, 'error': str(e)}
+            return
+        
+        response = "".join(parts)
+        logger.info(f"✓ RAG stream complete (confidence: {confidence:.2f})")
+        yield {'type': 'done', 'response': response, 'confidence': confidence, 'emergency': False}
+    
     @staticmethod
     def _extract_sources(matches: List[Dict]) -> List[Source]:
         """Extract and deduplicate sources"""
-        seen_urls = set()
-        sources = []
+        # Matches come sorted by score, so the first one per URL is its best;
+        # dicts keep insertion order
+        sources = {}
         
         for match in matches:
             url = match['source_url']
-            if url not in seen_urls:
-                sources.append(Source(
+            if url not in sources:
+                sources[url] = Source(
                     url=url,
                     title=match.get('title'),
                     relevance_score=match['score']
-                ))
-                seen_urls.add(url)
+                )
         
-        return sources
+        return list(sources.values())
 
 
 rag_pipeline = RAGPipeline()
@@ -1,26 +1,47 @@
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import time
+import aiofiles
+import httpx
+import xxhash
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+import lxml.html
 from typing import List, Dict, Optional
 from loguru import logger
-import time
 from urllib.parse import urljoin, urlparse
+from config import settings
 
 
 class MedicalScraper:
     """Scrapes medical articles from trusted sources"""
     
-    def __init__(self):
+    def __init__(self, cache_dir: Optional[Path] = None, cache_ttl: int = settings.SCRAPE_CACHE_TTL):
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
         self.base_url = "https://www.who.int"
+        
+        # Optional on-disk cache of page bodies so pipeline re-runs skip the network
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
     
-    def get_who_fact_sheet_links(self, max_topics: int = None) -> List[Dict[str, str]]:
+    def client(self) -> httpx.AsyncClient:
+        """Create an HTTP client with the scraper's headers"""
+        return httpx.AsyncClient(headers=self.headers, timeout=15, follow_redirects=True)
+    
+    async def get_who_fact_sheet_links(
+        self,
+        max_topics: int = None,
+        client: Optional[httpx.AsyncClient] = None
+    ) -> List[Dict[str, str]]:
         """
         Scrape WHO fact sheets page to get all topic links
         
         Args:
             max_topics: Maximum number of topics to scrape (None = scrape all)
+            client: Shared HTTP client (a temporary one is created if omitted)
             
         Returns:
             List of dicts with 'title' and 'url'
@@ -29,28 +50,30 @@ class MedicalScraper:
             url = f"{self.base_url}/news-room/fact-sheets"
             logger.info(f"Fetching WHO fact sheets from: {url}")
             
-            response = requests.get(url, headers=self.headers, timeout=15)
+            response = await self._get(url, client)
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.content, 'lxml')
+            tree = lxml.html.fromstring(response.content)
             
             # Find all fact sheet links
             # WHO fact sheets are typically in a list or grid format
             links = []
+            seen_urls = set()
             
             # Try different selectors to find fact sheet links
-            fact_sheet_links = soup.find_all('a', href=True)
+            fact_sheet_links = tree.xpath('//a[@href]')
             
             for link in fact_sheet_links:
                 href = link.get('href', '')
-                title = link.get_text(strip=True)
+                title = element_text(link)
                 
                 # Filter for fact sheet links
                 if '/news-room/fact-sheets/detail/' in href and title:
                     full_url = urljoin(self.base_url, href)
                     
                     # Avoid duplicates
-                    if not any(item['url'] == full_url for item in links):
+                    if full_url not in seen_urls:
+                        seen_urls.add(full_url)
                         links.append({
                             'title': title,
                             'url': full_url
@@ -67,75 +90,138 @@ class MedicalScraper:
             logger.error(f"✗ Failed to get WHO fact sheet links: {e}")
             return []
     
-    def scrape_who_fact_sheet(self, url: str, title: str) -> Optional[Dict[str, str]]:
+    def _cache_path(self, url: str) -> Path:
+        """Get the disk cache file for a URL"""
+        return self.cache_dir / f"{xxhash.xxh3_64_hexdigest(url.encode())}.html"
+    
+    def is_cached(self, url: str) -> bool:
+        """Check whether a fresh copy of the URL is on disk"""
+        if self.cache_dir is None:
+            return False
+        
+        cache_path = self._cache_path(url)
+        return cache_path.exists() and time.time() - cache_path.stat().st_mtime < self.cache_ttl
+    
+    async def _get(self, url: str, client: Optional[httpx.AsyncClient] = None) -> httpx.Response:
+        """GET a URL using the shared client, or a temporary one"""
+        if self.is_cached(url):
+            async with aiofiles.open(self._cache_path(url), "rb") as f:
+                content = await f.read()
+            logger.info(f"⚡ Disk cache hit: {url}")
+            return httpx.Response(200, content=content, request=httpx.Request("GET", url))
+        
+        if client is not None:
+            response = await client.get(url)
+        else:
+            async with self.client() as temp_client:
+                response = await temp_client.get(url)
+        
+        if self.cache_dir is not None and response.status_code == 200:
+            async with aiofiles.open(self._cache_path(url), "wb") as f:
+                await f.write(response.content)
+        
+        return response
+    
+    async def scrape_who_fact_sheet(
+        self,
+        url: str,
+        title: str,
+        client: Optional[httpx.AsyncClient] = None,
+        executor: Optional[Executor] = None
+    ) -> Optional[Dict[str, str]]:
         """
         Scrape a single WHO fact sheet page with section extraction
         
         Args:
             url: URL of the fact sheet
             title: Title of the fact sheet
+            client: Shared HTTP client (a temporary one is created if omitted)
+            executor: Executor to parse the page in (parsed inline if omitted)
             
         Returns:
             Dict with scraped content including sections
         """
         try:
-            response = requests.get(url, headers=self.headers, timeout=15)
+            response = await self._get(url, client)
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.content, 'lxml')
-            
-            # Remove unwanted elements
-            for element in soup(['script', 'style', 'nav', 'footer', 'header', 'aside', 'iframe']):
-                element.decompose()
-            
-            # Extract main content
-            content_selectors = [
-                'article',
-                'main',
-                '.sf-content-block',
-                '.detail-page',
-                '#PageContent',
-                '.page-content'
-            ]
+            if executor is None:
+                return parse_who_sections(response.content, url, title)
             
-            content_div = None
-            for selector in content_selectors:
-                content_div = soup.select_one(selector)
-                if content_div:
-                    break
+            # Parse in a worker process so the event loop keeps downloading
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, parse_who_sections, response.content, url, title)
             
-            if not content_div:
-                content_div = soup.find('body')
-            
-            # Extract content with section information
-            sections = []
-            current_section = None
-            current_content = []
+        except Exception as e:
+            logger.error(f"✗ Failed to scrape {url}: {e}")
+            return None
+
+
+def element_text(element: lxml.html.HtmlElement, separator: str = '') -> str:
+    """Stripped text fragments of an element joined by a separator"""
+    return separator.join(text.strip() for text in element.itertext() if text.strip())
+
+
+def _class_xpath(class_name: str) -> str:
+    """XPath matching elements that carry a CSS class"""
+    return f"//*[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+
+
+def parse_who_sections(html: bytes, url: str, title: str) -> Optional[Dict]:
+    """
+    Extract sectioned content from a WHO fact sheet page
+    
+    Pure function so it can run in a worker process.
+    
+    Args:
+        html: Raw page content
+        url: URL of the fact sheet
+        title: Title of the fact sheet
+        
+    Returns:
+        Dict with scraped content including sections
+    """
+    tree = lxml.html.fromstring(html)
+    
+    # Remove unwanted elements
+    for element in tree.xpath('//script | //style | //nav | //footer | //header | //aside | //iframe'):
+        element.drop_tree()
+    
+    # Extract main content (libxml2 XPath equivalents of the CSS selectors
+    # article, main, .sf-content-block, .detail-page, #PageContent, .page-content)
+    content_selectors = [
+        '//article',
+        '//main',
+        _class_xpath('sf-content-block'),
+        _class_xpath('detail-page'),
+        "//*[@id='PageContent']",
+        _class_xpath('page-content')
+    ]
+    
+    content_div = None
+    for selector in content_selectors:
+        matches = tree.xpath(selector)
+        if matches:
+            content_div = matches[0]
+            break
+    
+    if content_div is None:
+        content_div = next(iter(tree.xpath('//body')), None)
+    
+    # Extract content with section information
+    sections = []
+    current_section = None
+    current_content = []
+    
+    if content_div is not None:
+        # Headings and text blocks in document order; wrapper divs are skipped
+        # since their text is already covered by the paragraphs inside them
+        for element in content_div.xpath('.//h2 | .//h3 | .//h4 | .//p | .//li'):
+            text = element_text(element, separator=' ')
             
-            if content_div:
-                for element in content_div.find_all(['h1', 'h2', 'h3', 'h4', 'p', 'li', 'div']):
-                    text = element.get_text(separator=' ', strip=True)
-                    
-                    # Check if it's a heading (new section)
-                    if element.name in ['h2', 'h3', 'h4']:
-                        # Save previous section if exists
-                        if current_section and current_content:
-                            section_text = '\n\n'.join(current_content)
-                            if len(section_text) > 30:
-                                sections.append({
-                                    'section': current_section,
-                                    'content': section_text
-                                })
-                        
-                        # Start new section
-                        current_section = text if text else "General"
-                        current_content = []
-                    
-                    # Add content to current section (only if we have a section)
-                    elif current_section and len(text) > 30 and not text.startswith('http'):
-                        current_content.append(text)
-                
-                # Save last section
+            # Check if it's a heading (new section)
+            if element.tag in ['h2', 'h3', 'h4']:
+                # Save previous section if exists
                 if current_section and current_content:
                     section_text = '\n\n'.join(current_content)
                     if len(section_text) > 30:
@@ -143,77 +229,101 @@ class MedicalScraper:
                             'section': current_section,
                             'content': section_text
                         })
+                
+                # Start new section
+                current_section = text if text else "General"
+                current_content = []
             
-            if not sections:
-                logger.warning(f"⚠ No sections found for: {title}")
-                return None
-            
-            # Combine all content
-            full_text = '\n\n'.join([s['content'] for s in sections])
-            
-            if len(full_text) < 100:
-                logger.warning(f"⚠ Content too short for: {title}")
-                return None
-            
-            logger.info(f"✓ Scraped: {title} ({len(sections)} sections, {len(full_text)} chars)")
-            
-            return {
-                'url': url,
-                'title': title,
-                'content': full_text,
-                'sections': sections,  # Include section information
-                'source': 'WHO'
-            }
-            
-        except Exception as e:
-            logger.error(f"✗ Failed to scrape {url}: {e}")
-            return None
+            # Add content to current section (only if we have a section)
+            elif current_section and len(text) > 30 and not text.startswith('http'):
+                current_content.append(text)
+        
+        # Save last section
+        if current_section and current_content:
+            section_text = '\n\n'.join(current_content)
+            if len(section_text) > 30:
+                sections.append({
+                    'section': current_section,
+                    'content': section_text
+                })
     
+    if not sections:
+        logger.warning(f"⚠ No sections found for: {title}")
+        return None
+    
+    # Combine all content
+    full_text = '\n\n'.join([s['content'] for s in sections])
+    
+    if len(full_text) < 100:
+        logger.warning(f"⚠ Content too short for: {title}")
+        return None
+    
+    logger.info(f"✓ Scraped: {title} ({len(sections)} sections, {len(full_text)} chars)")
+    
+    return {
+        'url': url,
+        'title': title,
+        'content': full_text,
+        'sections': sections,  # Include section information
+        'source': 'WHO'
+    }
 
 
-
-def scrape_who_fact_sheets(max_topics: int = None, delay: float = 3.0) -> List[Dict[str, str]]:
+async def scrape_who_fact_sheets(
+    max_topics: int = None,
+    delay: float = 3.0,
+    concurrency: int = 8
+) -> List[Dict[str, str]]:
     """
     Main function to scrape WHO fact sheets
     
     Args:
         max_topics: Maximum number of topics to scrape (None = scrape all)
-        delay: Delay between requests (be polite to WHO servers)
+        delay: Delay each worker waits after a request (be polite to WHO servers)
+        concurrency: Maximum number of requests in flight
         
     Returns:
         List of scraped fact sheets
     """
-    scraper = MedicalScraper()
+    scraper = MedicalScraper(cache_dir=settings.SCRAPE_CACHE_DIR)
+    semaphore = asyncio.Semaphore(concurrency)
     
     logger.info("\n" + "="*60)
     logger.info("SCRAPING WHO FACT SHEETS")
     logger.info("="*60)
     
-    # Step 1: Get all fact sheet links
-    logger.info("\n[1/2] Getting fact sheet links...")
-    fact_sheets = scraper.get_who_fact_sheet_links(max_topics=max_topics)
-    
-    if not fact_sheets:
-        logger.error("✗ No fact sheets found")
-        return []
-    
-    # Step 2: Scrape each fact sheet
-    logger.info(f"\n[2/2] Scraping {len(fact_sheets)} fact sheets...")
-    results = []
+    # HTML parsing is CPU-bound, so it runs in worker processes alongside the downloads
+    with ProcessPoolExecutor() as executor:
+        async with scraper.client() as client:
+            # Step 1: Get all fact sheet links
+            logger.info("\n[1/2] Getting fact sheet links...")
+            fact_sheets = await scraper.get_who_fact_sheet_links(max_topics=max_topics, client=client)
+            
+            if not fact_sheets:
+                logger.error("✗ No fact sheets found")
+                return []
+            
+            # Step 2: Scrape fact sheets concurrently
+            logger.info(f"\n[2/2] Scraping {len(fact_sheets)} fact sheets...")
+            
+            async def scrape(i: int, sheet: Dict[str, str]) -> Optional[Dict[str, str]]:
+                async with semaphore:
+                    logger.info(f"\nScraping {i+1}/{len(fact_sheets)}: {sheet['title']}")
+                    from_disk = scraper.is_cached(sheet['url'])
+                    result = await scraper.scrape_who_fact_sheet(sheet['url'], sheet['title'], client, executor)
+                    
+                    # Be polite - hold the slot for a while so the request rate stays bounded
+                    if not from_disk:
+                        await asyncio.sleep(delay)
+                
+                if result:
+                    # Add topic categorization (simple keyword-based for MVP)
+                    result['topic'] = categorize_topic(sheet['title'])
+                return result
+            
+            scraped = await asyncio.gather(*[scrape(i, sheet) for i, sheet in enumerate(fact_sheets)])
     
-    for i, sheet in enumerate(fact_sheets):
-        logger.info(f"\nScraping {i+1}/{len(fact_sheets)}: {sheet['title']}")
-        
-        result = scraper.scrape_who_fact_sheet(sheet['url'], sheet['title'])
-        
-        if result:
-            # Add topic categorization (simple keyword-based for MVP)
-            result['topic'] = categorize_topic(sheet['title'])
-            results.append(result)
-        
-        # Be polite - delay between requests
-        if i < len(fact_sheets) - 1:
-            time.sleep(delay)
+    results = [result for result in scraped if result]
     
     logger.info(f"\n✓ Successfully scraped {len(results)} fact sheets")
     return results
@@ -243,7 +353,7 @@ def categorize_topic(title: str) -> str:
     return 'general'
 
 
-def scrape_medical_data(max_topics: int = None) -> List[Dict[str, str]]:
+async def scrape_medical_data(max_topics: int = None) -> List[Dict[str, str]]:
     """
     Main function to scrape WHO fact sheets
     
@@ -254,14 +364,14 @@ def scrape_medical_data(max_topics: int = None) -> List[Dict[str, str]]:
         List of scraped WHO fact sheets
     """
     # Scrape WHO fact sheets only
-    results = scrape_who_fact_sheets(max_topics=max_topics)
+    results = await scrape_who_fact_sheets(max_topics=max_topics)
     
     logger.info(f"\n✓ Total articles scraped: {len(results)}")
     return results
 
 
 if __name__ == "__main__":
-    results = scrape_medical_data(use_who=True, max_who_topics=20)
+    results = asyncio.run(scrape_medical_data(max_topics=20))
     
     # Print summary
     for result in results:
@@ -1,77 +1,234 @@
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict
+import numpy as np
+import torch
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from loguru import logger
 from config import settings
-import hashlib
+from core.embedding_cache import EmbeddingCache
+from functools import lru_cache
+from pathlib import Path
+import xxhash
+
+
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+
+# Chunk text is stored whole in Pinecone metadata, which is limited to 40 KB per vector
+MAX_CHUNK_BYTES = 32 * 1024
+
+
+@lru_cache(maxsize=1024)
+def _url_hash(url: str) -> str:
+    """Hash a URL once and reuse it for all of its chunk IDs"""
+    return xxhash.xxh3_64_hexdigest(url.encode())
+
+
+def load_embedding_model() -> Tuple[SentenceTransformer, str]:
+    """Load the embedding model and name the numeric variant it produces"""
+    # int8 ONNX export from the model repo, run by ONNX Runtime (VNNI kernels on x86)
+    if settings.EMBEDDING_BACKEND == "onnx" and not torch.cuda.is_available():
+        model = SentenceTransformer(
+            MODEL_NAME,
+            backend="onnx",
+            model_kwargs={"file_name": settings.EMBEDDING_ONNX_FILE}
+        )
+        logger.info(f"✓ Embedding model loaded from ONNX: {settings.EMBEDDING_ONNX_FILE}")
+        return model, f"onnx:{settings.EMBEDDING_ONNX_FILE}"
+    
+    # Fused scaled-dot-product attention; MiniLM is robust to fp16 on GPU
+    model_kwargs = {"attn_implementation": "sdpa"}
+    if torch.cuda.is_available():
+        model_kwargs["dtype"] = torch.float16
+    
+    model = SentenceTransformer(
+        MODEL_NAME,
+        model_kwargs=model_kwargs
+    )
+    
+    # Dynamic int8 quantization of the linear layers speeds up CPU inference
+    if settings.EMBEDDING_INT8 and model.device.type == "cpu":
+        torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+        logger.info("✓ Embedding model quantized to int8")
+        return model, "int8"
+    
+    return model, "fp"
+
+
+def truncate_utf8(text: str, max_bytes: int) -> str:
+    """Cut text to at most max_bytes of UTF-8 without splitting a character"""
+    encoded = text.encode()
+    if len(encoded) <= max_bytes:
+        return text
+    
+    logger.warning(f"⚠ Truncating {len(encoded)}-byte chunk to {max_bytes} bytes")
+    return encoded[:max_bytes].decode(errors='ignore')
 
 
 class TextProcessor:
     """Processes and chunks text for embedding"""
     
     def __init__(self):
-        self.splitter = RecursiveCharacterTextSplitter(
-            chunk_size=settings.CHUNK_SIZE,
+        self.embedding_model, self.embedding_variant = load_embedding_model()
+        
+        # Memo of repeated questions, owned by this instance rather than a
+        # class-level lru_cache that would key on (and pin) self
+        self._embed_query = lru_cache(maxsize=1024)(self._encode_query)
+        
+        # Chunk by model tokens so no chunk is silently truncated at encode time
+        # ([CLS] and [SEP] take two positions of the model window)
+        self.splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+            self.embedding_model.tokenizer,
+            chunk_size=min(settings.CHUNK_SIZE, self.embedding_model.max_seq_length - 2),
             chunk_overlap=settings.CHUNK_OVERLAP,
             separators=["\n\n", "\n", ". ", " ", ""]
         )
-        self.embedding_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+        
+        self.embedding_cache: Optional[EmbeddingCache] = None
         logger.info("✓ Text processor initialized")
     
+    def enable_embedding_cache(self, path: Path):
+        """Reuse stored embeddings for chunk texts that were embedded before"""
+        namespace = f"{MODEL_NAME}:{self.embedding_variant}"
+        self.embedding_cache = EmbeddingCache(path, namespace=namespace)
+    
     def clean_text(self, text: str) -> str:
         """Clean and normalize text"""
-        # Remove excessive whitespace
+        # Remove excessive whitespace; split()/join() runs in C and leaves no
+        # leading or trailing whitespace (faster than an re.sub over \s+)
         text = ' '.join(text.split())
         
         # Remove special characters but keep medical terms
         # (Keep hyphens, parentheses for medical notation)
         
-        return text.strip()
+        return text
     
     def chunk_text(self, text: str, metadata: Dict = None) -> List[Dict]:
         """Split text into chunks"""
         cleaned = self.clean_text(text)
         chunks = self.splitter.split_text(cleaned)
         
-        chunk_objects = []
-        for i, chunk in enumerate(chunks):
-            chunk_obj = {
-                'text': chunk,
-                'chunk_index': i,
-                'metadata': metadata or {}
-            }
-            chunk_objects.append(chunk_obj)
+        # A single token can span a long unbroken run of characters, so a chunk
+        # within the token budget can still exceed Pinecone's metadata limit
+        chunks = [truncate_utf8(chunk, MAX_CHUNK_BYTES) for chunk in chunks]
+        
+        metadata = metadata or {}
+        chunk_objects = [
+            {'text': chunk, 'chunk_index': i, 'metadata': metadata}
+            for i, chunk in enumerate(chunks)
+        ]
         
         logger.info(f"✓ Created {len(chunk_objects)} chunks")
         return chunk_objects
     
     def create_embedding(self, text: str) -> List[float]:
         """Generate embedding for text"""
+        return list(self._embed_query(text))
+    
+    def _encode_query(self, text: str) -> tuple:
+        """Embed a query; called through the per-instance _embed_query memo"""
         embedding = self.embedding_model.encode(text, convert_to_numpy=True)
-        return embedding.tolist()
+        return tuple(embedding.tolist())
+    
+    def create_embeddings_batch(
+        self,
+        texts: List[str],
+        batch_size: int = 64,
+        convert_to_numpy: bool = False
+    ) -> Union[List[List[float]], np.ndarray]:
+        """Generate embeddings for multiple texts, reusing cached ones when enabled"""
+        if self.embedding_cache is None:
+            embeddings = self._encode_batch(texts, batch_size)
+        else:
+            keys = [self.embedding_cache.key(text) for text in texts]
+            cached = self.embedding_cache.get_many(keys)
+            
+            # Encode only the texts not seen before (deduplicated)
+            misses = {key: text for key, text in zip(keys, texts) if key not in cached}
+            if misses:
+                encoded = dict(zip(misses, self._encode_batch(list(misses.values()), batch_size)))
+                self.embedding_cache.put_many(encoded)
+                cached.update(encoded)
+            
+            logger.info(f"✓ Embedding cache: {len(texts) - len(misses)} hits, {len(misses)} encoded")
+            embeddings = np.array([cached[key] for key in keys], dtype=np.float32)
+        
+        # One vectorized conversion for the whole batch when lists are wanted
+        return embeddings if convert_to_numpy else embeddings.tolist()
     
-    def create_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for multiple texts"""
-        embeddings = self.embedding_model.encode(texts, convert_to_numpy=True, show_progress_bar=True)
-        return embeddings.tolist()
+    def _encode_batch(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """Run the embedding model over a batch of texts"""
+        # encode() length-sorts texts internally and restores the original order,
+        # so passing everything in one call keeps padding per batch minimal
+        return self.embedding_model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=True
+        )
     
     @staticmethod
     def generate_doc_id(url: str, chunk_index: int) -> str:
         """Generate unique document ID"""
-        content = f"{url}:{chunk_index}"
-        return hashlib.md5(content.encode()).hexdigest()
+        return f"{_url_hash(url)}-{chunk_index}"
     
     def process_document(self, doc: Dict) -> List[Dict]:
         """Process a scraped document into chunks with embeddings and section info"""
+        return self.process_documents_bulk([doc])
+    
+    def process_documents_bulk(self, docs: List[Dict]) -> List[Dict]:
+        """Process many documents, embedding all of their chunks in one batch"""
+        all_chunks = []
+        for doc in docs:
+            all_chunks.extend(self._split_document(doc))
+        
+        if not all_chunks:
+            return []
+        
+        self._embed_chunks(all_chunks)
+        
+        logger.info(f"✓ Processed {len(all_chunks)} chunks with embeddings from {len(docs)} documents")
+        return all_chunks
+    
+    def stream_documents(self, docs: Iterable[Dict], batch_size: int = 512) -> Iterator[List[Dict]]:
+        """Yield embedded chunks in fixed-size batches as documents are split"""
+        pending = []
+        for doc in docs:
+            pending.extend(self._split_document(doc))
+            
+            while len(pending) >= batch_size:
+                batch, pending = pending[:batch_size], pending[batch_size:]
+                yield self._embed_chunks(batch)
+        
+        if pending:
+            yield self._embed_chunks(pending)
+    
+    def _embed_chunks(self, chunks: List[Dict]) -> List[Dict]:
+        """Attach embeddings to split chunks in place"""
+        # One large encode() keeps batches full instead of many small forward passes
+        # Rows stay NumPy views of one matrix; they are converted once at upsert time
+        embeddings = self.create_embeddings_batch(
+            [chunk['text'] for chunk in chunks],
+            batch_size=128,
+            convert_to_numpy=True
+        )
+        for chunk, embedding in zip(chunks, embeddings):
+            chunk['embedding'] = embedding
+        
+        return chunks
+    
+    def _split_document(self, doc: Dict) -> List[Dict]:
+        """Split a document into chunks (without embeddings)"""
         
         # Check if document has section information
         if 'sections' in doc and doc['sections']:
-            return self._process_document_with_sections(doc)
+            return self._split_document_with_sections(doc)
         else:
-            return self._process_document_legacy(doc)
+            return self._split_document_legacy(doc)
     
-    def _process_document_with_sections(self, doc: Dict) -> List[Dict]:
-        """Process document with section information"""
+    def _split_document_with_sections(self, doc: Dict) -> List[Dict]:
+        """Split document with section information"""
         all_chunks = []
         global_chunk_index = 0
         
@@ -90,16 +247,11 @@ class TextProcessor:
                 }
             )
             
-            # Generate embeddings for this section's chunks
-            texts = [chunk['text'] for chunk in chunks]
-            embeddings = self.create_embeddings_batch(texts)
-            
             # Create processed chunks
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+            for i, chunk in enumerate(chunks):
                 processed_chunk = {
                     'doc_id': self.generate_doc_id(doc['url'], global_chunk_index),
                     'text': chunk['text'],
-                    'embedding': embedding,
                     'source_url': doc['url'],
                     'title': doc['title'],
                     'topic': doc.get('topic', 'general'),
@@ -110,11 +262,10 @@ class TextProcessor:
                 all_chunks.append(processed_chunk)
                 global_chunk_index += 1
         
-        logger.info(f"✓ Processed {len(all_chunks)} chunks across {len(doc['sections'])} sections")
         return all_chunks
     
-    def _process_document_legacy(self, doc: Dict) -> List[Dict]:
-        """Process document without section information (legacy method)"""
+    def _split_document_legacy(self, doc: Dict) -> List[Dict]:
+        """Split document without section information (legacy method)"""
         chunks = self.chunk_text(
             doc['content'],
             metadata={
@@ -124,17 +275,11 @@ class TextProcessor:
             }
         )
         
-        # Generate embeddings
-        texts = [chunk['text'] for chunk in chunks]
-        embeddings = self.create_embeddings_batch(texts)
-        
-        # Combine chunks with embeddings
         processed_chunks = []
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+        for i, chunk in enumerate(chunks):
             processed_chunk = {
                 'doc_id': self.generate_doc_id(doc['url'], i),
                 'text': chunk['text'],
-                'embedding': embedding,
                 'source_url': doc['url'],
                 'title': doc['title'],
                 'topic': doc.get('topic', 'general'),
@@ -144,8 +289,6 @@ class TextProcessor:
             }
             processed_chunks.append(processed_chunk)
         
-        logger.info(f"✓ Processed {len(processed_chunks)} chunks with embeddings")
         return processed_chunks
 
-
 text_processor = TextProcessor()
@@ -1,18 +1,136 @@
+import numpy as np
+import orjson
 from pinecone import Pinecone, ServerlessSpec
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from loguru import logger
 from config import settings
+import threading
 import time
 
 
+# Pinecone rejects upsert requests larger than 2 MB
+MAX_UPSERT_REQUEST_BYTES = 2 * 1024 * 1024
+
+
+@lru_cache(maxsize=128)
+def _build_filter(topic: Optional[str], section: Optional[str]) -> Optional[Dict]:
+    """Build a metadata filter, shared between queries with the same arguments"""
+    filter_dict = {}
+    if topic:
+        filter_dict['topic'] = topic
+    if section:
+        filter_dict['section'] = section
+    
+    return filter_dict or None
+
+
+def quantize_int8(embedding: Union[List[float], np.ndarray]) -> np.ndarray:
+    """Scale an embedding to symmetric int8 levels"""
+    # Cosine similarity ignores the per-vector scale, so no dequantization is needed
+    values = np.asarray(embedding, dtype=np.float32)
+    max_abs = float(np.abs(values).max()) or 1.0
+    return np.round(values * (127 / max_abs)).astype(np.int8)
+
+
+class SearchCache:
+    """In-process LRU cache of search results keyed by query embedding similarity"""
+    
+    def __init__(self, maxsize: int, dimension: int, threshold: float):
+        self.threshold = threshold
+        self._vectors = np.zeros((maxsize, dimension), dtype=np.float32)
+        self._matches: List[Optional[List[Dict]]] = [None] * maxsize
+        
+        # Search arguments (top_k, filters) are interned so slots can be masked in bulk
+        self._arg_ids: Dict[Tuple, int] = {}
+        self._slot_args = np.full(maxsize, -1, dtype=np.int64)
+        
+        # Last-use tick per slot; -1 marks an empty slot. Empty slots are filled
+        # in index order, so only the first _size rows need scoring
+        self._last_used = np.full(maxsize, -1, dtype=np.int64)
+        self._size = 0
+        self._tick = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        """Scale an embedding to unit length so dot products are cosines"""
+        vec = np.asarray(embedding, dtype=np.float32)
+        return vec / (np.linalg.norm(vec) or 1.0)
+    
+    def get(self, embedding: List[float], args: Tuple) -> Optional[List[Dict]]:
+        """Return cached matches for a near-identical query with the same arguments"""
+        query = self._normalize(embedding)
+        with self._lock:
+            arg_id = self._arg_ids.get(args)
+            if arg_id is None:
+                return None
+            
+            filled = slice(0, self._size)
+            similarities = np.where(
+                self._slot_args[filled] == arg_id, self._vectors[filled] @ query, -np.inf
+            )
+            if not len(similarities):
+                return None
+            
+            slot = int(similarities.argmax())
+            if similarities[slot] < self.threshold:
+                return None
+            
+            self._tick += 1
+            self._last_used[slot] = self._tick
+            return self._matches[slot]
+    
+    def put(self, embedding: List[float], args: Tuple, matches: List[Dict]):
+        """Cache matches, evicting the least recently used entry when full"""
+        query = self._normalize(embedding)
+        with self._lock:
+            arg_id = self._arg_ids.setdefault(args, len(self._arg_ids))
+            slot = int(self._last_used.argmin())
+            self._size = max(self._size, slot + 1)
+            
+            self._tick += 1
+            self._vectors[slot] = query
+            self._matches[slot] = matches
+            self._slot_args[slot] = arg_id
+            self._last_used[slot] = self._tick
+    
+    def clear(self):
+        """Drop all cached results"""
+        with self._lock:
+            self._matches = [None] * len(self._matches)
+            self._slot_args.fill(-1)
+            self._last_used.fill(-1)
+            self._size = 0
+
+
 class VectorDatabase:
     """Manages Pinecone vector database"""
     
+    dimension = 384  # all-MiniLM-L6-v2 dimension
+    _index_lock = threading.Lock()
+    
     def __init__(self):
         self.pc = Pinecone(api_key=settings.PINECONE_API_KEY)
         self.index_name = settings.PINECONE_INDEX_NAME
         self.index = None
-        self.dimension = 384  # all-MiniLM-L6-v2 dimension
+    
+    @cached_property
+    def search_cache(self) -> SearchCache:
+        """Cache of recent search results, created on first search"""
+        return SearchCache(
+            settings.SEARCH_CACHE_MAXSIZE, self.dimension, settings.SEARCH_CACHE_THRESHOLD
+        )
+    
+    @cached_property
+    def query_executor(self) -> ThreadPoolExecutor:
+        """Threads that send batched searches to Pinecone in parallel"""
+        return ThreadPoolExecutor(
+            max_workers=settings.PINECONE_QUERY_CONCURRENCY,
+            thread_name_prefix="pinecone-query"
+        )
     
     def create_index(self):
         """Create Pinecone index if it doesn't exist"""
@@ -32,32 +150,73 @@ class VectorDatabase:
                     )
                 )
                 
-                # Wait for index to be ready
-                while not self.pc.describe_index(self.index_name).status['ready']:
-                    time.sleep(1)
+                self._wait_until_ready()
                 
                 logger.info(f"✓ Index {self.index_name} created")
             else:
                 logger.info(f"✓ Index {self.index_name} already exists")
             
-            self.index = self.pc.Index(self.index_name)
+            # gRPC sends values as packed floats rather than JSON text
+            self.index = self.pc.index(name=self.index_name, grpc=settings.PINECONE_USE_GRPC)
             
         except Exception as e:
             logger.error(f"✗ Failed to create index: {e}")
             raise
     
-    def upsert_documents(self, chunks: List[Dict], batch_size: int = 100):
+    def _ensure_index(self):
+        """Connect to the index on first use, once even under concurrent searches"""
+        if self.index is None:
+            with self._index_lock:
+                if self.index is None:
+                    self.create_index()
+    
+    def _wait_until_ready(self):
+        """Poll the index status with exponential backoff until it is ready"""
+        deadline = time.monotonic() + settings.PINECONE_INDEX_READY_TIMEOUT
+        delay = 0.05
+        
+        while not self.pc.describe_index(self.index_name).status['ready']:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Index {self.index_name} not ready after {settings.PINECONE_INDEX_READY_TIMEOUT}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+    
+    def upsert_documents(self, chunks: Iterable[Dict], batch_size: int = None):
         """Upload document chunks to Pinecone"""
-        if not self.index:
-            self.create_index()
-        
-        vectors = []
-        for chunk in chunks:
-            vector = {
-                'id': chunk['doc_id'],
-                'values': chunk['embedding'],
-                'metadata': {
-                    'text': chunk['text'][:1000],  # Pinecone metadata limit
+        self._ensure_index()
+        
+        # Upsert in groups of batches sent in parallel by the client's thread pool;
+        # vector dicts are built one group at a time so only one group is held in memory
+        upsert_options = {
+            'batch_size': batch_size or settings.PINECONE_UPSERT_BATCH_SIZE,
+            'max_concurrency': settings.PINECONE_UPSERT_CONCURRENCY,
+            'show_progress': False
+        }
+        total = 0
+        for group in self._iter_groups(chunks, settings.PINECONE_UPSERT_GROUP_SIZE):
+            self._upsert_group(group, upsert_options)
+            total += len(group)
+        
+        # Cached results may no longer be the nearest neighbours
+        self.search_cache.clear()
+        
+        logger.info(f"✓ Total vectors upserted: {total}")
+    
+    @staticmethod
+    def _iter_groups(chunks: Iterable[Dict], group_size: int) -> Iterator[List[Tuple]]:
+        """Lazily build Pinecone vectors from chunks, yielding them in groups"""
+        # (id, values, metadata) tuples avoid an outer dict per vector
+        # Embeddings arrive as NumPy rows; the client converts each with one tolist()
+        # int8 levels only shorten JSON text; gRPC packs every value as a float32
+        # anyway, so there quantizing would only add rounding error to the scores
+        quantize = settings.PINECONE_INT8_VALUES and not settings.PINECONE_USE_GRPC
+        encode = quantize_int8 if quantize else np.asarray
+        vectors = (
+            (
+                chunk['doc_id'],
+                encode(chunk['embedding']),
+                {
+                    'text': chunk['text'],
                     'source_url': chunk['source_url'],
                     'title': chunk['title'],
                     'topic': chunk['topic'],
@@ -65,16 +224,40 @@ class VectorDatabase:
                     'chunk_index': chunk['chunk_index'],
                     'section_chunk_index': chunk.get('section_chunk_index', 0)
                 }
-            }
-            vectors.append(vector)
+            )
+            for chunk in chunks
+        )
+        while group := list(islice(vectors, group_size)):
+            yield group
+    
+    @staticmethod
+    def _record_bytes(vector: Tuple) -> int:
+        """Upper estimate of a vector's serialized size in an upsert request"""
+        vector_id, values, metadata = vector
+        # gRPC packs each value into 4 bytes; as JSON text a value takes at most
+        # ~20 characters. Metadata is sized by its JSON encoding either way
+        value_bytes = 4 if settings.PINECONE_USE_GRPC else 20
+        return len(vector_id) + value_bytes * len(values) + len(orjson.dumps(metadata))
+    
+    def _upsert_group(self, vectors: List[Tuple], upsert_options: Dict):
+        """Upsert a group of vectors, retrying failed batches once"""
+        # Shrink batches for groups with large metadata so no request exceeds the cap
+        largest = max(map(self._record_bytes, vectors))
+        upsert_options = {
+            **upsert_options,
+            'batch_size': max(1, min(upsert_options['batch_size'], MAX_UPSERT_REQUEST_BYTES // largest))
+        }
         
-        # Upsert in batches
-        for i in range(0, len(vectors), batch_size):
-            batch = vectors[i:i + batch_size]
-            self.index.upsert(vectors=batch)
-            logger.info(f"✓ Upserted batch {i//batch_size + 1} ({len(batch)} vectors)")
+        response = self.index.upsert(vectors=vectors, **upsert_options)
         
-        logger.info(f"✓ Total vectors upserted: {len(vectors)}")
+        # Partial failures don't raise; retry the failed vectors once
+        if response.has_errors:
+            logger.warning(f"⚠ Retrying {len(response.failed_items)} failed vectors")
+            response = self.index.upsert(vectors=response.failed_items, **upsert_options)
+            
+            if response.has_errors:
+                logger.error(f"✗ Failed to upsert {len(response.failed_items)} vectors: {response.errors}")
+                raise RuntimeError(f"Failed to upsert {len(response.failed_items)} vectors")
     
     def search(
         self,
@@ -84,30 +267,28 @@ class VectorDatabase:
         section_filter: Optional[str] = None
     ) -> List[Dict]:
         """Search for similar documents with optional section filtering"""
-        if not self.index:
-            self.create_index()
-        
         top_k = top_k or settings.TOP_K_RESULTS
         
-        # Build filter
-        filter_dict = {}
-        if topic_filter:
-            filter_dict['topic'] = topic_filter
-        if section_filter:
-            filter_dict['section'] = section_filter
+        # Repeated questions skip the Pinecone round-trip
+        search_args = (top_k, topic_filter, section_filter)
+        cached = self.search_cache.get(query_embedding, search_args)
+        if cached is not None:
+            logger.info(f"⚡ Search cache HIT ({len(cached)} matches)")
+            return cached
+        
+        self._ensure_index()
         
         # Query
         results = self.index.query(
             vector=query_embedding,
             top_k=top_k,
             include_metadata=True,
-            filter=filter_dict if filter_dict else None
+            filter=_build_filter(topic_filter, section_filter)
         )
         
         # Format results
-        matches = []
-        for match in results['matches']:
-            matches.append({
+        matches = [
+            {
                 'id': match['id'],
                 'score': match['score'],
                 'text': match['metadata']['text'],
@@ -116,15 +297,36 @@ class VectorDatabase:
                 'topic': match['metadata']['topic'],
                 'section': match['metadata'].get('section', 'General'),
                 'chunk_index': match['metadata'].get('chunk_index', 0)
-            })
+            }
+            for match in results['matches']
+        ]
+        
+        self.search_cache.put(query_embedding, search_args, matches)
         
         logger.info(f"✓ Found {len(matches)} matches")
         return matches
     
+    def search_batch(
+        self,
+        query_embeddings: Union[List[List[float]], np.ndarray],
+        top_k: int = None,
+        topic_filter: Optional[str] = None,
+        section_filter: Optional[str] = None
+    ) -> List[List[Dict]]:
+        """Search for several query embeddings, returning matches in input order"""
+        self._ensure_index()
+        
+        # Pinecone has no batch query endpoint, so the single queries are sent
+        # concurrently; each still goes through the search cache
+        queries = np.asarray(query_embeddings, dtype=np.float32).tolist()
+        return list(self.query_executor.map(
+            lambda query: self.search(query, top_k, topic_filter, section_filter),
+            queries
+        ))
+    
     def get_stats(self) -> Dict:
         """Get index statistics"""
-        if not self.index:
-            self.create_index()
+        self._ensure_index()
         
         stats = self.index.describe_index_stats()
         return {
@@ -133,10 +335,24 @@ class VectorDatabase:
             'index_fullness': stats.index_fullness
         }
     
+    def close(self):
+        """Close the index connection pool and query threads"""
+        if 'query_executor' in self.__dict__:
+            self.query_executor.shutdown(wait=False)
+            del self.query_executor
+        
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        
+        self.pc.close()
+        logger.info("Pinecone connection closed")
+    
     def delete_all(self):
         """Delete all vectors (use with caution)"""
         if self.index:
             self.index.delete(delete_all=True)
+            self.search_cache.clear()
             logger.warning("⚠ Deleted all vectors from index")
 
 
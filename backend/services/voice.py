@@ -1,104 +1,326 @@
-import whisper
+import torch
+import numpy as np
+from faster_whisper import WhisperModel
+from faster_whisper.feature_extractor import FeatureExtractor
 from gtts import gTTS
+from piper import PiperVoice
 import os
+import wave
+import xxhash
 import uuid
 from loguru import logger
 from config import settings
-from pydub import AudioSegment
+import subprocess
 import tempfile
-from typing import Dict
+import threading
+import time
+from pathlib import Path
+from functools import cached_property, lru_cache
+from typing import BinaryIO, Dict, Optional, Tuple, Union
+
+
+class TorchFeatureExtractor(FeatureExtractor):
+    """Whisper log-mel feature extractor running on torch, on the GPU when available"""
+    
+    def __init__(self, device: str = "cpu", **kwargs):
+        super().__init__(**kwargs)
+        self.device = device
+        
+        # Filters and window are moved to the device once, not per call
+        self.mel_filters_tensor = torch.from_numpy(self.mel_filters).to(device)
+        self.window = torch.hann_window(self.n_fft, device=device)
+    
+    def __call__(self, waveform: np.ndarray, padding=160, chunk_length=None):
+        """Compute the log-mel spectrogram of one waveform or a batch of them"""
+        if chunk_length is not None:
+            self.n_samples = chunk_length * self.sampling_rate
+            self.nb_max_frames = self.n_samples // self.hop_length
+        
+        audio = torch.as_tensor(waveform, dtype=torch.float32, device=self.device)
+        if padding:
+            audio = torch.nn.functional.pad(audio, (0, padding))
+        
+        stft = torch.stft(audio, self.n_fft, self.hop_length, window=self.window, return_complex=True)
+        magnitudes = stft[..., :-1].abs() ** 2
+        
+        mel_spec = self.mel_filters_tensor @ magnitudes
+        
+        log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+        log_spec = torch.maximum(log_spec, log_spec.amax(dim=(-2, -1), keepdim=True) - 8.0)
+        log_spec = (log_spec + 4.0) / 4.0
+        
+        return log_spec.cpu().numpy()
+
+
+# Suffix of the marker file recording a failed synthesis of an audio file
+FAILED_MARKER = ".failed"
+
+_whisper_lock = threading.Lock()
+_piper_lock = threading.Lock()
+
+
+def _whisper_device() -> Tuple[str, str]:
+    """Pick the Whisper device and quantized compute type"""
+    # CTranslate2 falls back to float32 on CPUs without fast int8 kernels (no AVX2)
+    if not torch.cuda.is_available():
+        return "cpu", "int8"
+    
+    # Tensor cores (compute capability 7.0+) run int8 weights with fp16 activations
+    if torch.cuda.get_device_capability()[0] >= 7:
+        return "cuda", "int8_float16"
+    return "cuda", "int8"
+
+
+@lru_cache(maxsize=None)
+def load_whisper_model(model_name: str) -> WhisperModel:
+    """Load a Whisper model once per process, shared by every VoiceService"""
+    device, compute_type = _whisper_device()
+    logger.info(f"Loading Whisper model: {model_name} ({device}, {compute_type})")
+    # One shared model; extra workers let concurrent transcriptions (each on its
+    # own to_thread worker) run in parallel instead of queueing on a single one
+    model = WhisperModel(
+        model_name,
+        device=device,
+        compute_type=compute_type,
+        num_workers=settings.WHISPER_NUM_WORKERS
+    )
+    
+    # Compute log-mel features with torch (on the GPU when available) instead of NumPy
+    model.feature_extractor = TorchFeatureExtractor(device=device, **model.feat_kwargs)
+    logger.info("✓ Whisper loaded")
+    return model
+
+
+@lru_cache(maxsize=None)
+def load_piper_voice(voice_path: Path) -> PiperVoice:
+    """Load a Piper voice once per process, shared by every VoiceService"""
+    logger.info(f"Loading Piper voice: {voice_path}")
+    voice = PiperVoice.load(voice_path, use_cuda=torch.cuda.is_available())
+    logger.info("✓ Piper loaded")
+    return voice
 
 
 class VoiceService:
     """Handles speech-to-text and text-to-speech"""
     
     def __init__(self):
-        # Load Whisper model
-        logger.info(f"Loading Whisper model: {settings.WHISPER_MODEL}")
-        self.whisper_model = whisper.load_model(settings.WHISPER_MODEL)
-        logger.info("✓ Whisper loaded")
-        
-        # gTTS doesn't need model loading, it's API-based
-        logger.info("✓ gTTS ready (Google Text-to-Speech)")
-        
         # Ensure output directory exists
         os.makedirs("static/audio", exist_ok=True)
     
-    def transcribe_audio(self, audio_path: str) -> Dict[str, str]:
+    @cached_property
+    def piper_voice(self) -> Optional[PiperVoice]:
+        """Local Piper voice, or None to fall back to gTTS"""
+        if not settings.USE_LOCAL_TTS:
+            logger.info("✓ gTTS ready (Google Text-to-Speech)")
+            return None
+        
+        if not settings.PIPER_VOICE_PATH.exists():
+            logger.warning(f"⚠ Piper voice not found at {settings.PIPER_VOICE_PATH}, falling back to gTTS")
+            return None
+        
+        # The voice is read from request handlers and background TTS threads at once
+        with _piper_lock:
+            return load_piper_voice(settings.PIPER_VOICE_PATH)
+    
+    @cached_property
+    def whisper_model(self) -> WhisperModel:
+        """Whisper model, loaded on first transcription"""
+        # Concurrent first transcriptions wait for a single load
+        with _whisper_lock:
+            return load_whisper_model(settings.WHISPER_MODEL)
+    
+    def preload_tts(self):
+        """Load the TTS voice before serving so requests never pay for it"""
+        self.piper_voice
+    
+    def warmup(self):
+        """Load Whisper and run one transcription of silence"""
+        # Segments are generated lazily, so consume them to actually run the decoder
+        segments, _ = self.whisper_model.transcribe(
+            np.zeros(self.whisper_model.feature_extractor.sampling_rate, dtype=np.float32),
+            language="en",
+            beam_size=1
+        )
+        list(segments)
+        logger.info("✓ Whisper warmed up")
+    
+    def transcribe_audio(self, audio: Union[str, BinaryIO]) -> Dict[str, str]:
         """
         Convert speech to text using Whisper
         
         Args:
-            audio_path: Path to audio file
+            audio: Path to an audio file, or an in-memory file object
             
         Returns:
             Dict with transcribed text and language
         """
         try:
-            logger.info(f"Transcribing audio: {audio_path}")
+            logger.info("Transcribing audio")
             
-            # Transcribe
-            result = self.whisper_model.transcribe(
-                audio_path,
+            # Transcribe; segments are generated lazily as they are decoded, and
+            # silence is trimmed by VAD so only speech reaches the encoder
+            segments, info = self.whisper_model.transcribe(
+                audio,
                 language="en",
-                fp16=False
+                beam_size=1,
+                vad_filter=True
             )
             
-            transcribed_text = result["text"].strip()
+            transcribed_text = "".join(segment.text for segment in segments).strip()
             logger.info(f"✓ Transcribed: {transcribed_text[:100]}...")
             
             return {
                 'text': transcribed_text,
-                'language': result.get('language', 'en')
+                'language': info.language
             }
             
         except Exception as e:
             logger.error(f"✗ Transcription failed: {e}")
             raise
     
+    def speech_url(self, text: str) -> str:
+        """URL path the synthesized audio for a text is served from"""
+        # Identical text always maps to the same file, so repeated replies are reused
+        extension = "wav" if self.piper_voice is not None else "mp3"
+        return f"/static/audio/{xxhash.xxh3_128_hexdigest(text.encode())}.{extension}"
+    
+    def audio_status(self, audio_url: str) -> str:
+        """Whether the audio behind a URL is ready, still pending, or failed to render"""
+        output_path = audio_url.lstrip("/")
+        if os.path.exists(output_path):
+            return "ready"
+        
+        # Failures are marker files next to the audio so every worker sees them
+        try:
+            failed_at = os.stat(f"{output_path}{FAILED_MARKER}").st_mtime
+        except FileNotFoundError:
+            return "pending"
+        return "failed" if time.time() - failed_at < settings.AUDIO_FAILURE_TTL else "pending"
+    
     def text_to_speech(self, text: str, session_id: str = None) -> str:
         """
-        Convert text to speech using gTTS
+        Convert text to speech with the local Piper voice, or gTTS as a fallback
         
         Args:
             text: Text to convert
-            session_id: Optional session ID for filename
+            session_id: Optional session ID (unused; files are shared by content)
             
         Returns:
             URL path to generated audio file
         """
+        audio_url = self.speech_url(text)
+        self.render_speech(text, audio_url)
+        return audio_url
+    
+    def render_speech(self, text: str, audio_url: str):
+        """Synthesize text into the file behind an audio URL, unless it already exists"""
         try:
-            # Generate unique filename
-            filename = f"{session_id or uuid.uuid4()}.mp3"
-            output_path = f"static/audio/{filename}"
+            output_path = audio_url.lstrip("/")
+            
+            try:
+                # Mark the file recently used (atime is unreliable under noatime/relatime)
+                os.utime(output_path)
+                logger.info(f"⚡ Reusing cached audio: {output_path}")
+                return
+            except FileNotFoundError:
+                pass
             
             logger.info(f"Generating speech for text: {text[:100]}...")
             
-            # Generate speech with gTTS
-            tts = gTTS(text=text, lang='en', slow=False)
-            tts.save(output_path)
+            # Write to a private temp file and rename so readers never see partial audio
+            temp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+            try:
+                if self.piper_voice is not None:
+                    # Synthesize locally, no network round-trip
+                    with wave.open(temp_path, "wb") as wav_file:
+                        self.piper_voice.synthesize_wav(text, wav_file)
+                else:
+                    # Generate speech with gTTS
+                    tts = gTTS(text=text, lang='en', slow=False)
+                    tts.save(temp_path)
+                
+                os.replace(temp_path, output_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
             
             logger.info(f"✓ Audio saved: {output_path}")
             
-            # Return URL path
-            return f"/static/audio/{filename}"
+            try:
+                os.unlink(f"{output_path}{FAILED_MARKER}")
+            except FileNotFoundError:
+                pass
             
         except Exception as e:
             logger.error(f"✗ TTS failed: {e}")
+            try:
+                Path(f"{output_path}{FAILED_MARKER}").touch()
+            except OSError as marker_error:
+                logger.warning(f"⚠ Could not record TTS failure: {marker_error}")
             raise
+        
+        # Outside the render's error handling: the audio is already in place,
+        # so a failed eviction must not mark it failed
+        try:
+            self.evict_audio_cache(os.path.dirname(output_path))
+        except OSError as e:
+            logger.warning(f"⚠ Audio cache eviction failed: {e}")
     
     @staticmethod
-    def convert_audio_format(input_path: str, output_format: str = "wav") -> str:
+    def evict_audio_cache(audio_dir: str, max_files: Optional[int] = None):
+        """Delete the least recently used audio files beyond the cache limit"""
+        max_files = settings.AUDIO_CACHE_MAX_FILES if max_files is None else max_files
+        
+        # Stat while listing; renders in other threads and workers evict concurrently,
+        # so entries can vanish at any point and are simply skipped
+        files = []
+        with os.scandir(audio_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    if entry.name.endswith(FAILED_MARKER):
+                        # Expired failure markers are dropped; live ones aren't audio
+                        if time.time() - entry.stat().st_mtime >= settings.AUDIO_FAILURE_TTL:
+                            os.unlink(entry.path)
+                    elif entry.is_file():
+                        files.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    continue
+        
+        if len(files) <= max_files:
+            return
+        
+        files.sort()
+        evicted = 0
+        for _, path in files[:len(files) - max_files]:
+            try:
+                os.unlink(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+        logger.info(f"✓ Evicted {evicted} cached audio files")
+    
+    @staticmethod
+    def convert_audio_format(input_path: str, output_format: str = "wav", sample_rate: int = 16000) -> str:
         """Convert audio to different format"""
         try:
-            audio = AudioSegment.from_file(input_path)
-            
             output_path = tempfile.NamedTemporaryFile(
                 suffix=f".{output_format}",
                 delete=False
             ).name
             
-            audio.export(output_path, format=output_format)
+            # ffmpeg decodes and re-encodes in a single streaming pass; 16 kHz mono
+            # is what Whisper resamples to anyway
+            subprocess.run(
+                [
+                    "ffmpeg", "-y", "-loglevel", "error",
+                    "-i", input_path,
+                    "-ac", "1", "-ar", str(sample_rate),
+                    "-f", output_format, output_path
+                ],
+                check=True
+            )
             logger.info(f"✓ Converted audio to {output_format}")
             
             return output_path
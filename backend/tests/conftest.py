@@ -2,6 +2,7 @@
 Pytest configuration and shared fixtures for backend tests
 """
 import pytest
+import pytest_asyncio
 import sys
 import os
 from unittest.mock import MagicMock, AsyncMock
@@ -10,6 +11,34 @@ from unittest.mock import MagicMock, AsyncMock
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 
+@pytest.fixture(scope="session")
+def event_loop_policy():
+    """Run async tests on uvloop, the loop the server uses"""
+    import uvloop
+    return uvloop.EventLoopPolicy()
+
+
+@pytest.fixture(scope="session")
+def text_processor():
+    """Shared text processor with the embedding model loaded and warmed once"""
+    from services.text_processor import text_processor
+    text_processor.create_embeddings_batch(["warmup"])
+    return text_processor
+
+
+@pytest.fixture(autouse=True)
+def mongo_stub(monkeypatch):
+    """In-memory Motor client shared by every repository in a test"""
+    from mongomock_motor import AsyncMongoMockClient
+    from config import settings
+    from core.database import mongodb_client
+    
+    client = AsyncMongoMockClient()
+    monkeypatch.setattr(mongodb_client, 'client', client)
+    monkeypatch.setattr(mongodb_client, 'db', client[settings.MONGODB_DB_NAME])
+    yield client
+
+
 @pytest.fixture
 def mock_redis_client():
     """Mock Redis client"""
@@ -126,7 +155,7 @@ def sample_rag_response():
     }
 
 
-@pytest.fixture
+@pytest_asyncio.fixture(loop_scope="session")
 async def cleanup_test_files():
     """Cleanup test files after tests"""
     yield
@@ -77,6 +77,107 @@ async def test_text_chat():
         assert isinstance(data["sources"], list)
 
 
+@pytest.mark.asyncio
+async def test_text_chat_embedding_runs_off_event_loop():
+    """Test a slow query encode doesn't block other requests on the event loop"""
+    import asyncio
+    import threading
+    from fastapi import BackgroundTasks
+    from api.routes.chat import chat_text
+    from models.schemas import ChatRequest
+    
+    other_request_ran = threading.Event()
+    
+    def slow_embedding(query):
+        # Only finishes if the event loop keeps serving the other request meanwhile
+        assert other_request_ran.wait(timeout=2)
+        return [0.1] * 384
+    
+    async def other_request():
+        await asyncio.sleep(0)
+        other_request_ran.set()
+    
+    with patch('api.routes.chat.cache_manager.get_raw', new_callable=AsyncMock, return_value=None), \
+         patch('api.routes.chat.cache_manager.get', new_callable=AsyncMock, return_value=None), \
+         patch('api.routes.chat.cache_manager.get_similar', new_callable=AsyncMock, return_value={
+             "response": "Diabetes is a chronic disease.",
+             "sources": [],
+             "confidence": 0.9
+         }), \
+         patch('api.routes.chat.text_processor.create_embedding', side_effect=slow_embedding):
+        
+        response, _ = await asyncio.gather(
+            chat_text(ChatRequest(query="What is diabetes?", session_id="test-session"), BackgroundTasks()),
+            other_request()
+        )
+    
+    assert response.response == "Diabetes is a chronic disease."
+
+
+def test_text_chat_cache_hit():
+    """Test cached responses are returned without running RAG"""
+    import orjson
+    with patch('api.routes.chat.rag_pipeline.query') as mock_rag, \
+         patch('api.routes.chat.cache_manager.get_raw') as mock_cache_get_raw:
+        
+        mock_cache_get_raw.return_value = orjson.dumps({
+            "response": "Diabetes is a chronic disease.",
+            "sources": [{"url": "https://www.who.int/diabetes", "title": "Diabetes", "relevance_score": 0.9}],
+            "confidence": 0.9,
+            "cached": True,
+            "transcribed_query": None,
+            "audio_url": None
+        })
+        
+        payload = {
+            "query": "What is diabetes?",
+            "session_id": "test-session-123"
+        }
+        
+        response = client.post("/api/chat/text", json=payload)
+        assert response.status_code == 200
+        
+        data = response.json()
+        assert data["cached"] is True
+        assert data["sources"][0]["url"] == "https://www.who.int/diabetes"
+        mock_rag.assert_not_called()
+
+
+def test_text_chat_stream():
+    """Test streamed chat returns NDJSON events and persists the turn"""
+    import orjson
+    from models.schemas import Source
+    
+    async def fake_stream(query, query_embedding=None):
+        yield {'type': 'sources', 'sources': [Source(url="https://www.who.int/diabetes", relevance_score=0.9)], 'confidence': 0.9}
+        yield {'type': 'delta', 'delta': "Diabetes is "}
+        yield {'type': 'delta', 'delta': "a chronic disease."}
+        yield {'type': 'done', 'response': "Diabetes is a chronic disease.", 'confidence': 0.9, 'emergency': False}
+    
+    with patch('api.routes.chat.rag_pipeline.query_stream', fake_stream), \
+         patch('api.routes.chat.cache_manager.get', new_callable=AsyncMock, return_value=None), \
+         patch('api.routes.chat.cache_manager.get_similar', new_callable=AsyncMock, return_value=None), \
+         patch('api.routes.chat.persist_turn_background', new_callable=AsyncMock) as mock_persist:
+        
+        payload = {
+            "query": "What is diabetes?",
+            "session_id": "test-session-stream"
+        }
+        
+        response = client.post("/api/chat/text/stream", json=payload)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        
+        events = [orjson.loads(line) for line in response.text.splitlines()]
+        assert [e['type'] for e in events] == ['sources', 'delta', 'delta', 'done']
+        assert events[0]['sources'][0]['url'] == "https://www.who.int/diabetes"
+        assert events[-1]['response'] == "Diabetes is a chronic disease."
+        assert events[-1]['cached'] is False
+        
+        query_doc = mock_persist.call_args[0][0]
+        assert query_doc['response'] == "Diabetes is a chronic disease."
+
+
 def test_text_chat_missing_query():
     """Test text chat with missing query"""
     payload = {
@@ -154,6 +255,97 @@ def test_voice_chat_endpoint_exists():
     assert response.status_code != 404
 
 
+def test_voice_chat_rejects_non_audio():
+    """Test non-audio uploads are rejected before processing"""
+    response = client.post(
+        "/api/chat/voice",
+        files={"audio_file": ("notes.txt", b"not audio", "text/plain")},
+        data={"session_id": "test-session"}
+    )
+    assert response.status_code == 400
+
+
+def test_voice_chat_rejects_oversized_upload():
+    """Test uploads over the size limit are rejected"""
+    from config import settings
+    
+    with patch.object(settings, 'MAX_AUDIO_BYTES', 8):
+        response = client.post(
+            "/api/chat/voice",
+            files={"audio_file": ("clip.wav", b"0123456789", "audio/wav")},
+            data={"session_id": "test-session"}
+        )
+    assert response.status_code == 413
+
+
+def test_voice_chat_renders_audio_after_response():
+    """Test voice chat returns the audio URL and synthesizes it in the background"""
+    with patch('api.routes.voice.voice_service.transcribe_audio', return_value={'text': 'What is diabetes?', 'language': 'en'}) as mock_transcribe, \
+         patch('api.routes.voice.cache_manager.get', new_callable=AsyncMock, return_value={
+             "response": "Diabetes is a chronic disease.",
+             "sources": [],
+             "confidence": 0.9
+         }), \
+         patch('api.routes.voice.voice_service.speech_url', return_value="/static/audio/reply.mp3"), \
+         patch('api.routes.voice.voice_service.render_speech') as mock_render, \
+         patch('api.routes.voice.persist_turn_background', new_callable=AsyncMock):
+        
+        response = client.post(
+            "/api/chat/voice",
+            files={"audio_file": ("clip.wav", b"0123456789", "audio/wav")},
+            data={"session_id": "test-session"}
+        )
+    
+    assert response.status_code == 200
+    assert response.json()["audio_url"] == "/static/audio/reply.mp3"
+    mock_render.assert_called_once_with("Diabetes is a chronic disease.", "/static/audio/reply.mp3")
+    
+    # The upload is handed to Whisper in memory, not via a temp file
+    assert mock_transcribe.call_args[0][0].getvalue() == b"0123456789"
+
+
+def test_voice_chat_omits_audio_after_failed_synthesis():
+    """Test a reply whose synthesis just failed gets no audio URL"""
+    with patch('api.routes.voice.voice_service.transcribe_audio', return_value={'text': 'What is diabetes?', 'language': 'en'}), \
+         patch('api.routes.voice.cache_manager.get', new_callable=AsyncMock, return_value={
+             "response": "Diabetes is a chronic disease.",
+             "sources": [],
+             "confidence": 0.9
+         }), \
+         patch('api.routes.voice.voice_service.audio_status', return_value="failed"), \
+         patch('api.routes.voice.voice_service.render_speech') as mock_render, \
+         patch('api.routes.voice.persist_turn_background', new_callable=AsyncMock):
+        
+        response = client.post(
+            "/api/chat/voice",
+            files={"audio_file": ("clip.wav", b"0123456789", "audio/wav")},
+            data={"session_id": "test-session"}
+        )
+    
+    assert response.status_code == 200
+    assert response.json()["audio_url"] is None
+    mock_render.assert_not_called()
+
+
+@pytest.mark.parametrize("status", ["pending", "ready", "failed"])
+def test_voice_audio_status(status):
+    """Test the audio status endpoint reports the render state"""
+    file_name = "0123456789abcdef0123456789abcdef.mp3"
+    
+    with patch('api.routes.voice.voice_service.audio_status', return_value=status) as mock_status:
+        response = client.get(f"/api/chat/voice/audio/{file_name}")
+    
+    assert response.status_code == 200
+    assert response.json() == {"status": status}
+    mock_status.assert_called_once_with(f"/static/audio/{file_name}")
+
+
+def test_voice_audio_status_rejects_unknown_names():
+    """Test only synthesized audio file names are looked up"""
+    response = client.get("/api/chat/voice/audio/..%2Fconfig.py")
+    assert response.status_code == 404
+
+
 def test_cors_headers():
     """Test CORS headers are present"""
     response = client.options("/api/chat/text")
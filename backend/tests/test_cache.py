@@ -8,6 +8,14 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 from core.cache import CacheManager
 
 
+def mock_pipeline(mock_client):
+    """Attach a Redis pipeline mock to a mocked client"""
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(return_value=[])
+    mock_client.pipeline = MagicMock(return_value=pipe)
+    return pipe
+
+
 @pytest.mark.asyncio
 async def test_cache_key_generation():
     """Test cache key generation"""
@@ -44,12 +52,13 @@ async def test_cache_operations():
         assert result is None
         
         # Test cache set
+        pipe = mock_pipeline(mock_client)
         test_data = {"response": "Test response", "confidence": 0.9}
-        mock_client.setex.return_value = True
         await cache.set("test query", test_data, "session1")
         
         # Verify setex was called
-        assert mock_client.setex.called
+        assert pipe.setex.called
+        assert pipe.execute.called
 
 
 @pytest.mark.asyncio
@@ -78,12 +87,14 @@ async def test_cache_ttl():
     
     with patch('core.database.redis_client.client', new_callable=AsyncMock) as mock_client:
         
+        pipe = mock_pipeline(mock_client)
         test_data = {"response": "Test"}
         await cache.set("query", test_data, "session1")
         
         # Verify setex was called with default TTL from settings
-        call_args = mock_client.setex.call_args
+        call_args = pipe.setex.call_args
         assert call_args is not None
+        assert call_args[0][1] == cache.ttl
 
 
 @pytest.mark.asyncio
@@ -100,3 +111,138 @@ async def test_cache_invalidation():
             
             # Verify delete or similar method was called
             assert mock_client.delete.called or mock_client.method_calls
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_raw_bytes():
+    """Test cache hit when Redis returns raw bytes"""
+    cache = CacheManager()
+    
+    with patch('core.database.redis_client.client', new_callable=AsyncMock) as mock_client:
+        mock_client.get.return_value = b'{"response": "Cached response", "confidence": 0.85}'
+        
+        result = await cache.get("diabetes query", "session1")
+        
+        assert result == {"response": "Cached response", "confidence": 0.85}
+
+
+@pytest.mark.asyncio
+async def test_local_cache_skips_redis():
+    """Test in-process tier serves repeat hits without Redis"""
+    cache = CacheManager()
+    
+    with patch('core.database.redis_client.client', new_callable=AsyncMock) as mock_client:
+        mock_client.get.return_value = b'{"response": "Cached response", "confidence": 0.85}'
+        
+        await cache.get("diabetes query", "session1")
+        result = await cache.get("diabetes query", "session1")
+        
+        assert result["response"] == "Cached response"
+        assert mock_client.get.call_count == 1
+
+
+def test_lock_shared_per_key():
+    """Test concurrent lookups for the same query share a lock"""
+    cache = CacheManager()
+    
+    lock1 = cache.lock("What is diabetes?", "session1")
+    lock2 = cache.lock("what is diabetes? ", "session1")
+    lock3 = cache.lock("What is diabetes?", "session2")
+    
+    assert lock1 is lock2
+    assert lock1 is not lock3
+
+
+def test_semantic_key_buckets_similar_embeddings():
+    """Test near-duplicate embeddings share a semantic bucket"""
+    cache = CacheManager()
+    
+    embedding = [0.1, -0.2, 0.3, -0.4] * 96
+    similar = [0.12, -0.18, 0.31, -0.39] * 96
+    different = [-0.1, 0.2, -0.3, 0.4] * 96
+    
+    key1 = cache._generate_semantic_key(embedding, "session1")
+    
+    assert key1 == cache._generate_semantic_key(similar, "session1")
+    assert key1 != cache._generate_semantic_key(different, "session1")
+    assert key1 != cache._generate_semantic_key(embedding, "session2")
+    assert key1.startswith("chat:sem:")
+
+
+@pytest.mark.asyncio
+async def test_get_similar_revalidates_embedding():
+    """Test semantic hits are served only above the similarity threshold"""
+    import orjson
+    cache = CacheManager()
+    
+    embedding = [0.1, -0.2, 0.3, -0.4] * 96
+    entry = orjson.dumps({'key': 'chat:exact', 'embedding': embedding})
+    response = orjson.dumps({"response": "Cached response", "confidence": 0.85})
+    
+    with patch('core.database.redis_client.client', new_callable=AsyncMock) as mock_client:
+        mock_client.get.side_effect = [entry, response]
+        result = await cache.get_similar(embedding, "session1")
+        assert result["response"] == "Cached response"
+        
+        # Same sign pattern in the bucket prefix but dissimilar overall
+        unrelated = [0.1, -0.2, 0.3, -0.4] * 4 + [-0.1, 0.2, -0.3, 0.4] * 92
+        mock_client.get.side_effect = [entry]
+        assert await cache.get_similar(unrelated, "session1") is None
+
+
+@pytest.mark.asyncio
+async def test_cache_payload_compressed_roundtrip():
+    """Test cached payloads are zstd-compressed and decode back"""
+    cache = CacheManager()
+    test_data = {"response": "Diabetes explanation. " * 100, "confidence": 0.9}
+    
+    with patch('core.database.redis_client.client', new_callable=AsyncMock) as mock_client:
+        pipe = mock_pipeline(mock_client)
+        await cache.set("query", test_data, "session1")
+        stored = pipe.setex.call_args[0][2]
+        
+        assert stored[:1] == b"\x01"
+        assert len(stored) < len(test_data["response"])
+        
+        mock_client.get.return_value = stored
+        result = await CacheManager().get("query", "session1")
+        assert result == test_data
+
+
+@pytest.mark.asyncio
+async def test_cache_get_raw_returns_json_bytes():
+    """Test raw cache reads return decompressed JSON without re-serializing"""
+    import orjson
+    cache = CacheManager()
+    test_data = {"response": "Cached response", "confidence": 0.85, "cached": True}
+    
+    with patch('core.database.redis_client.client', new_callable=AsyncMock) as mock_client:
+        mock_client.get.return_value = cache._encode(test_data)
+        
+        raw = await cache.get_raw("diabetes query", "session1")
+        
+        assert isinstance(raw, bytes)
+        assert orjson.loads(raw) == test_data
+
+
+@pytest.mark.asyncio
+async def test_clear_session_unlinks_indexed_keys():
+    """Test session entries are indexed on set and unlinked on clear"""
+    cache = CacheManager()
+    
+    with patch('core.database.redis_client.client', new_callable=AsyncMock) as mock_client:
+        pipe = mock_pipeline(mock_client)
+        await cache.set("query", {"response": "Test"}, "session1")
+        
+        key = cache._generate_key("query", "session1")
+        pipe.sadd.assert_called_once_with("chat:session:session1", key)
+        
+        mock_client.smembers.return_value = {key.encode()}
+        assert await cache.clear_session("session1") is True
+        
+        mock_client.unlink.assert_called_once_with(key.encode(), "chat:session:session1")
+        mock_client.keys.assert_not_called()
+        
+        # Local tier entry is dropped too
+        mock_client.get.return_value = None
+        assert await cache.get("query", "session1") is None
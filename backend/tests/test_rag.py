@@ -1,191 +1,158 @@
 import pytest
 import sys
 import os
-from unittest.mock import AsyncMock, MagicMock, patch
+from contextlib import ExitStack
+from types import SimpleNamespace
+from unittest.mock import patch
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from services.rag import RAGPipeline
 
+# Shared query embedding; the pipeline never mutates it
+FAKE_EMBEDDING = [0.1] * 384
 
-@pytest.mark.asyncio
-async def test_rag_query_success():
-    """Test successful RAG query"""
-    with patch('services.text_processor.text_processor') as mock_processor, \
-         patch('services.vector_store.vector_db') as mock_vector, \
-         patch('repositories.mongo_repo.query_repo') as mock_mongo, \
-         patch('services.llm.llm_service') as mock_llm, \
-         patch('core.cache.cache_manager') as mock_cache:
-        
-        # Mock embedding generation
-        mock_processor.create_embedding.return_value = [0.1] * 384
-        
-        # Mock vector search
-        mock_vector.search.return_value = [
-            {'id': 'chunk1', 'score': 0.9},
-            {'id': 'chunk2', 'score': 0.85},
-            {'id': 'chunk3', 'score': 0.8}
-        ]
-        
-        # Mock MongoDB retrieval
-        mock_mongo.get_chunks_by_ids = AsyncMock(return_value=[
-            {
-                'text': 'Diabetes is a chronic disease.',
-                'metadata': {'url': 'https://who.int/diabetes', 'title': 'Diabetes'}
-            },
-            {
-                'text': 'Symptoms include increased thirst.',
-                'metadata': {'url': 'https://who.int/diabetes', 'title': 'Diabetes'}
-            }
-        ])
-        
-        # Mock LLM generation
-        mock_llm.generate_response = AsyncMock(return_value={
-            'response': 'Diabetes is a chronic disease affecting blood sugar.',
-            'confidence': 0.9
-        })
-        
-        # Mock cache miss
-        mock_cache.get = AsyncMock(return_value=None)
-        mock_cache.set = AsyncMock()
-        
-        rag = RAGPipeline()
-        result = await rag.query("What is diabetes?")
-        
-        assert result is not None
-        assert 'response' in result
-        assert 'confidence' in result
-        assert 'sources' in result
 
+@pytest.fixture(scope="module")
+def rag_patches():
+    """Patch the RAG pipeline's services once for the whole module"""
+    with ExitStack() as stack:
+        yield SimpleNamespace(
+            processor=stack.enter_context(patch('services.rag.text_processor')),
+            vector=stack.enter_context(patch('services.rag.vector_db')),
+            llm=stack.enter_context(patch('services.rag.llm_service'))
+        )
 
-@pytest.mark.asyncio
-async def test_rag_cache_hit():
-    """Test RAG pipeline with successful query"""
-    with patch('services.rag.text_processor') as mock_processor, \
-         patch('services.rag.vector_db') as mock_vector, \
-         patch('services.rag.llm_service') as mock_llm:
-        
-        mock_processor.create_embedding.return_value = [0.1] * 384
-        
-        # vector_db.search() returns formatted results with text field
-        mock_vector.search.return_value = [
-            {
-                'id': 'chunk1',
-                'score': 0.85,
-                'text': 'Diabetes information',
-                'source_url': 'https://who.int/diabetes',
-                'title': 'Diabetes',
-                'topic': 'general',
-                'section': 'General',
-                'chunk_index': 0
-            }
-        ]
-        
-        mock_llm.generate_response.return_value = {
-            'response': 'Response about diabetes',
-            'confidence': 0.9,
-            'emergency': False
-        }
-        
-        rag = RAGPipeline()
-        result = await rag.query("What is diabetes?")
-        
-        assert result is not None
-        assert result['response'] == 'Response about diabetes'
-        assert result['confidence'] == 0.9
-        assert result['response'] == 'Response about diabetes'
-        assert result['confidence'] == 0.9
-        assert result['response'] == 'Response about diabetes'
-        assert result['confidence'] == 0.9
+
+@pytest.fixture
+def rag_mocks(rag_patches):
+    """Module-wide service mocks, reset after each test"""
+    rag_patches.processor.create_embedding.return_value = FAKE_EMBEDDING
+    yield rag_patches
+    for mock in vars(rag_patches).values():
+        mock.reset_mock(return_value=True, side_effect=True)
+
+
+def make_match(chunk_id, score):
+    """Vector search match as returned by vector_db.search"""
+    return {
+        'id': chunk_id,
+        'score': score,
+        'text': 'Diabetes information',
+        'source_url': 'https://who.int/diabetes',
+        'title': 'Diabetes',
+        'topic': 'general',
+        'section': 'General',
+        'chunk_index': 0
+    }
 
 
 @pytest.mark.asyncio
-async def test_rag_no_results():
-    """Test RAG when no vector search results"""
-    with patch('services.text_processor.text_processor') as mock_processor, \
-         patch('services.vector_store.vector_db') as mock_vector, \
-         patch('core.cache.cache_manager') as mock_cache:
-        
-        mock_processor.create_embedding.return_value = [0.1] * 384
-        mock_vector.search.return_value = []
-        mock_cache.get = AsyncMock(return_value=None)
-        
-        rag = RAGPipeline()
-        result = await rag.query("Unknown query")
-        
-        assert result is not None
-        assert 'response' in result
+@pytest.mark.parametrize("query, scores, llm_response, llm_confidence", [
+    ("What is diabetes?", [0.9, 0.85, 0.8], 'Diabetes is a chronic disease affecting blood sugar.', 0.9),
+    ("What is diabetes?", [0.85], 'Response about diabetes', 0.9),
+    ("Unknown query", [], None, None),
+    ("Unclear query", [0.4, 0.3], 'Low confidence response', 0.4),
+    ("Clear query", [0.95, 0.92], 'High confidence response', 0.95)
+], ids=["success", "single_match", "no_results", "low_confidence", "high_confidence"])
+async def test_rag_query(rag_mocks, query, scores, llm_response, llm_confidence):
+    """Test RAG queries return the LLM answer, or the fallback when nothing matches"""
+    from services.rag import NO_MATCHES_RESPONSE
+    
+    rag_mocks.vector.search.return_value = [make_match(f'chunk{i}', score) for i, score in enumerate(scores)]
+    rag_mocks.llm.generate_response.return_value = {'response': llm_response, 'confidence': llm_confidence}
+    
+    result = await RAGPipeline().query(query)
+    
+    if not scores:
+        assert result == {'response': NO_MATCHES_RESPONSE, 'sources': [], 'confidence': 0.0}
+        rag_mocks.llm.generate_response.assert_not_called()
+    else:
+        assert result['response'] == llm_response
+        assert result['confidence'] == llm_confidence
+        assert [s.url for s in result['sources']] == ['https://who.int/diabetes']
+        assert result['emergency'] is False
 
 
 @pytest.mark.asyncio
-async def test_rag_low_confidence_scores():
-    """Test RAG with low similarity scores"""
-    with patch('services.text_processor.text_processor') as mock_processor, \
-         patch('services.vector_store.vector_db') as mock_vector, \
-         patch('repositories.mongo_repo.query_repo') as mock_mongo, \
-         patch('services.llm.llm_service') as mock_llm, \
-         patch('core.cache.cache_manager') as mock_cache:
-        
-        mock_processor.create_embedding.return_value = [0.1] * 384
-        
-        # Low similarity scores
-        mock_vector.search.return_value = [
-            {'id': 'chunk1', 'score': 0.4},
-            {'id': 'chunk2', 'score': 0.3}
-        ]
-        
-        mock_mongo.get_chunks_by_ids = AsyncMock(return_value=[
-            {'text': 'Some text', 'metadata': {}}
-        ])
-        
-        mock_llm.generate_response = AsyncMock(return_value={
-            'response': 'Low confidence response',
-            'confidence': 0.4
-        })
-        
-        mock_cache.get = AsyncMock(return_value=None)
-        mock_cache.set = AsyncMock()
-        
-        rag = RAGPipeline()
-        result = await rag.query("Unclear query")
-        
-        assert result['confidence'] < 0.7
+async def test_rag_query_stream_events(rag_mocks):
+    """Test streamed RAG emits sources, deltas and the full response"""
+    from services.llm import Llama3LLM
+    
+    matches = [
+        {'id': 'chunk1', 'score': 0.4, 'text': 'Diabetes is a chronic disease.',
+         'source_url': 'https://who.int/diabetes', 'title': 'Diabetes'},
+        {'id': 'chunk2', 'score': 0.3, 'text': 'Symptoms include thirst.',
+         'source_url': 'https://who.int/diabetes', 'title': 'Diabetes'}
+    ]
+    
+    async def fake_stream(query, context_chunks):
+        for token in ["Diabetes ", "is chronic."]:
+            yield token
+    
+    rag_mocks.vector.search.return_value = matches
+    rag_mocks.llm.compute_confidence.side_effect = Llama3LLM.compute_confidence
+    rag_mocks.llm.generate_response_stream.side_effect = fake_stream
+    
+    rag = RAGPipeline()
+    events = [e async for e in rag.query_stream("What is diabetes?", query_embedding=FAKE_EMBEDDING)]
+    
+    assert events[0]['type'] == 'sources'
+    assert len(events[0]['sources']) == 1
+    assert events[0]['confidence'] == pytest.approx(0.35)
+    
+    deltas = [e['delta'] for e in events if e['type'] == 'delta']
+    done = events[-1]
+    
+    # Low confidence prefix is streamed first, matching format_response
+    assert deltas[0].startswith("⚠️")
+    assert done['type'] == 'done'
+    assert done['response'] == "".join(deltas)
+    assert done['response'].endswith("Diabetes is chronic.")
+
+
+def test_confidence_keeps_score_precision():
+    """Test confidence is the exact mean of the match scores, capped at 1"""
+    from services.llm import Llama3LLM
+    
+    assert Llama3LLM.compute_confidence([{'score': 0.9}]) == 0.9
+    assert Llama3LLM.compute_confidence([{'score': 0.4}, {'score': 0.3}]) == (0.4 + 0.3) / 2
+    assert Llama3LLM.compute_confidence([{'score': 1.2}]) == 1.0
+
+
+def test_extract_sources_keeps_first_per_url():
+    """Test sources are deduplicated by URL keeping the top-scored match"""
+    matches = [
+        {'source_url': 'https://who.int/diabetes', 'title': 'Diabetes', 'score': 0.9},
+        {'source_url': 'https://who.int/asthma', 'title': 'Asthma', 'score': 0.8},
+        {'source_url': 'https://who.int/diabetes', 'title': 'Diabetes', 'score': 0.7}
+    ]
+    
+    sources = RAGPipeline._extract_sources(matches)
+    
+    assert [s.url for s in sources] == ['https://who.int/diabetes', 'https://who.int/asthma']
+    assert sources[0].relevance_score == 0.9
 
 
 @pytest.mark.asyncio
-async def test_rag_confidence_calculation():
-    """Test RAG confidence score calculation"""
-    with patch('services.text_processor.text_processor') as mock_processor, \
-         patch('services.vector_store.vector_db') as mock_vector, \
-         patch('repositories.mongo_repo.query_repo') as mock_mongo, \
-         patch('services.llm.llm_service') as mock_llm, \
-         patch('core.cache.cache_manager') as mock_cache:
-        
-        mock_processor.create_embedding.return_value = [0.1] * 384
-        
-        mock_vector.search.return_value = [
-            {'id': 'chunk1', 'score': 0.95},
-            {'id': 'chunk2', 'score': 0.92}
-        ]
-        
-        mock_mongo.get_chunks_by_ids = AsyncMock(return_value=[
-            {'text': 'High quality match', 'metadata': {}}
-        ])
-        
-        mock_llm.generate_response = AsyncMock(return_value={
-            'response': 'High confidence response',
-            'confidence': 0.95
-        })
-        
-        mock_cache.get = AsyncMock(return_value=None)
-        mock_cache.set = AsyncMock()
-        
-        rag = RAGPipeline()
-        result = await rag.query("Clear query")
-        
-        # Confidence should be high with good matches and high LLM confidence
-        assert result is not None
-        assert 'confidence' in result
-        assert isinstance(result['confidence'], (int, float))
-        # Accept any confidence >= 0 since pipeline may adjust it
-        assert result['confidence'] >= 0.0
+async def test_rag_concurrent_searches_overlap(rag_mocks):
+    """Test vector searches run off the event loop so concurrent queries overlap"""
+    import asyncio
+    import threading
+    
+    # Each search waits for the other two, so they only pass if all three run at once
+    barrier = threading.Barrier(3, timeout=5)
+    
+    def slow_search(**kwargs):
+        barrier.wait()
+        return []
+    
+    rag_mocks.vector.search.side_effect = slow_search
+    rag = RAGPipeline()
+    
+    await asyncio.gather(*[
+        rag.query("What is diabetes?", query_embedding=FAKE_EMBEDDING) for _ in range(3)
+    ])
+    
+    assert rag_mocks.vector.search.call_count == 3
+    assert not barrier.broken
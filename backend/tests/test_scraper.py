@@ -1,16 +1,19 @@
 import pytest
 import sys
 import os
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from services.scraper import MedicalScraper
+from services.scraper import MedicalScraper, parse_who_sections
 
-scraper = MedicalScraper()
+@pytest.fixture(scope="module")
+def scraper():
+    """Scraper shared by the tests in this module"""
+    return MedicalScraper()
 
 
-def test_categorize_topic():
+def test_categorize_topic(scraper):
     """Test topic categorization - method is private/internal"""
     # Skip test if method doesn't exist
     if not hasattr(scraper, 'categorize_topic'):
@@ -19,9 +22,10 @@ def test_categorize_topic():
         assert scraper.categorize_topic("diabetes") in ["Infectious Diseases", "Non-communicable Diseases", "Other"]
 
 
-def test_get_who_fact_sheet_links():
+@pytest.mark.asyncio
+async def test_get_who_fact_sheet_links(scraper):
     """Test fetching WHO fact sheet links"""
-    with patch('requests.get') as mock_get:
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
         # Mock HTML response
         mock_response = MagicMock()
         mock_response.status_code = 200
@@ -35,15 +39,36 @@ def test_get_who_fact_sheet_links():
         '''
         mock_get.return_value = mock_response
         
-        links = scraper.get_who_fact_sheet_links(max_topics=2)
+        links = await scraper.get_who_fact_sheet_links(max_topics=2)
         
         assert isinstance(links, list)
         assert len(links) <= 2
 
 
-def test_scrape_who_fact_sheet():
+@pytest.mark.asyncio
+async def test_get_who_fact_sheet_links_deduplicates(scraper):
+    """Test repeated fact sheet links are returned once, in page order"""
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
+        mock_response = MagicMock()
+        mock_response.content = b'''
+        <html><body>
+            <a href="/news-room/fact-sheets/detail/diabetes">Diabetes</a>
+            <a href="/news-room/fact-sheets/detail/malaria">Malaria</a>
+            <a href="https://www.who.int/news-room/fact-sheets/detail/diabetes">Diabetes</a>
+            <a href="/about">About</a>
+        </body></html>
+        '''
+        mock_get.return_value = mock_response
+        
+        links = await scraper.get_who_fact_sheet_links()
+        
+        assert [link['title'] for link in links] == ['Diabetes', 'Malaria']
+
+
+@pytest.mark.asyncio
+async def test_scrape_who_fact_sheet(scraper):
     """Test scraping individual fact sheet"""
-    with patch('requests.get') as mock_get:
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
         mock_response = MagicMock()
         mock_response.status_code = 200
         # Create content that's long enough (minimum 200 chars)
@@ -62,7 +87,7 @@ def test_scrape_who_fact_sheet():
         '''
         mock_get.return_value = mock_response
         
-        result = scraper.scrape_who_fact_sheet("https://www.who.int/diabetes", "Diabetes")
+        result = await scraper.scrape_who_fact_sheet("https://www.who.int/diabetes", "Diabetes")
         
         assert result is not None
         assert 'title' in result
@@ -71,9 +96,10 @@ def test_scrape_who_fact_sheet():
         assert len(result['sections']) > 0
 
 
-def test_scrape_with_sections():
+@pytest.mark.asyncio
+async def test_scrape_with_sections(scraper):
     """Test that scraper extracts sections correctly"""
-    with patch('requests.get') as mock_get:
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
         mock_response = MagicMock()
         mock_response.status_code = 200
         # Add sufficient content length
@@ -92,7 +118,7 @@ def test_scrape_with_sections():
         '''
         mock_get.return_value = mock_response
         
-        result = scraper.scrape_who_fact_sheet("https://example.com", "Test")
+        result = await scraper.scrape_who_fact_sheet("https://example.com", "Test")
         
         if result is not None:
             assert len(result['sections']) >= 2
@@ -103,21 +129,22 @@ def test_scrape_with_sections():
             assert True
 
 
-def test_scrape_handles_http_errors():
+@pytest.mark.asyncio
+async def test_scrape_handles_http_errors(scraper):
     """Test scraper handles HTTP errors gracefully"""
-    with patch('requests.get') as mock_get:
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
         mock_response = MagicMock()
         mock_response.status_code = 404
         mock_response.raise_for_status.side_effect = Exception("Not Found")
         mock_get.return_value = mock_response
         
-        result = scraper.scrape_who_fact_sheet("https://invalid.url", "Test")
+        result = await scraper.scrape_who_fact_sheet("https://invalid.url", "Test")
         
         # Should handle error gracefully (return None or empty)
         assert result is None or result == {}
 
 
-def test_clean_text():
+def test_clean_text(scraper):
     """Test text cleaning in scraper"""
     dirty_text = "Text  with   multiple    spaces\n\n\nand newlines"
     
@@ -127,9 +154,10 @@ def test_clean_text():
         assert "  " not in clean
 
 
-def test_extract_metadata():
+@pytest.mark.asyncio
+async def test_extract_metadata(scraper):
     """Test metadata extraction from scraped content"""
-    with patch('requests.get') as mock_get:
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
         mock_response = MagicMock()
         mock_response.status_code = 200
         mock_response.content = b'''
@@ -148,7 +176,7 @@ def test_extract_metadata():
         '''
         mock_get.return_value = mock_response
         
-        result = scraper.scrape_who_fact_sheet("https://example.com", "Health")
+        result = await scraper.scrape_who_fact_sheet("https://example.com", "Health")
         
         if result is not None:
             assert 'title' in result
@@ -157,3 +185,95 @@ def test_extract_metadata():
             assert True
         assert 'url' in result
         assert result['title'] == "Health"
+
+
+@pytest.mark.asyncio
+async def test_scrape_who_fact_sheets_concurrent():
+    """Test fact sheets are scraped concurrently with a bounded number in flight"""
+    import asyncio
+    from services.scraper import scrape_who_fact_sheets
+    
+    sheets = [{'title': f'Diabetes {i}', 'url': f'https://www.who.int/{i}'} for i in range(6)]
+    in_flight = 0
+    peak = 0
+    
+    async def fake_scrape(self, url, title, client=None, executor=None):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return {'url': url, 'title': title, 'content': 'text', 'sections': [], 'source': 'WHO'}
+    
+    with patch.object(MedicalScraper, 'get_who_fact_sheet_links', new_callable=AsyncMock, return_value=sheets), \
+         patch.object(MedicalScraper, 'scrape_who_fact_sheet', fake_scrape):
+        results = await scrape_who_fact_sheets(delay=0, concurrency=3)
+    
+    assert len(results) == 6
+    assert peak == 3
+    assert [r['url'] for r in results] == [s['url'] for s in sheets]
+    assert all(r['topic'] == 'diabetes' for r in results)
+
+
+@pytest.mark.asyncio
+async def test_scrape_parses_in_executor(scraper):
+    """Test page parsing can be dispatched to an executor"""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    html = b'''
+    <html><body>
+        <h2>Key Facts</h2>
+        <p>Malaria is a life-threatening disease spread to humans by some types of mosquitoes.</p>
+        <h2>Prevention</h2>
+        <p>Vector control and preventive medicines are used to reduce the spread of malaria.</p>
+    </body></html>
+    '''
+    
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
+        mock_get.return_value = MagicMock(content=html)
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            result = await scraper.scrape_who_fact_sheet("https://www.who.int/malaria", "Malaria", executor=executor)
+    
+    assert result == parse_who_sections(html, "https://www.who.int/malaria", "Malaria")
+    assert [s['section'] for s in result['sections']] == ['Key Facts', 'Prevention']
+
+
+@pytest.mark.asyncio
+async def test_disk_cache_skips_network(tmp_path):
+    """Test pages are served from the disk cache on re-runs"""
+    cached_scraper = MedicalScraper(cache_dir=tmp_path)
+    
+    with patch('httpx.AsyncClient.get', new_callable=AsyncMock) as mock_get:
+        mock_get.return_value = MagicMock(status_code=200, content=b'<html>page</html>')
+        
+        first = await cached_scraper._get("https://www.who.int/diabetes")
+        second = await cached_scraper._get("https://www.who.int/diabetes")
+        
+        assert mock_get.call_count == 1
+        assert cached_scraper.is_cached("https://www.who.int/diabetes")
+        assert second.content == first.content
+        
+        # Errors are not cached
+        mock_get.return_value = MagicMock(status_code=404, content=b'missing')
+        await cached_scraper._get("https://www.who.int/missing")
+        assert not cached_scraper.is_cached("https://www.who.int/missing")
+
+
+def test_parse_does_not_duplicate_wrapped_paragraphs():
+    """Test text inside wrapper divs is extracted once"""
+    html = b'''
+    <html><body><article>
+        <h2>Overview</h2>
+        <div class="wrapper">
+            <div><p>Asthma is a chronic disease affecting the airways in the lungs of children and adults.</p></div>
+            <p>Inhaled medication can control symptoms and allow people to lead a normal, active life.</p>
+        </div>
+    </article></body></html>
+    '''
+    
+    result = parse_who_sections(html, "https://www.who.int/asthma", "Asthma")
+    
+    content = result['sections'][0]['content']
+    assert content.count("Asthma is a chronic disease") == 1
+    assert content.count("Inhaled medication") == 1
@@ -4,10 +4,8 @@ import os
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from services.text_processor import text_processor
 
-
-def test_text_cleaning():
+def test_text_cleaning(text_processor):
     """Test text cleaning"""
     dirty_text = "This  has   multiple    spaces\n\nand\n\nnewlines"
     clean = text_processor.clean_text(dirty_text)
@@ -16,7 +14,7 @@ def test_text_cleaning():
     assert clean == "This has multiple spaces and newlines"
 
 
-def test_text_cleaning_special_characters():
+def test_text_cleaning_special_characters(text_processor):
     """Test text cleaning with special characters"""
     text = "Text with\ttabs\rand\r\ncarriage returns"
     clean = text_processor.clean_text(text)
@@ -26,7 +24,7 @@ def test_text_cleaning_special_characters():
     # Check that text is cleaned (may have different number of spaces)
 
 
-def test_text_chunking():
+def test_text_chunking(text_processor):
     """Test text chunking"""
     long_text = " ".join(["This is a test sentence."] * 100)
     chunks = text_processor.chunk_text(long_text)
@@ -37,7 +35,7 @@ def test_text_chunking():
     assert all(isinstance(chunk['chunk_index'], int) for chunk in chunks)
 
 
-def test_text_chunking_with_sections():
+def test_text_chunking_with_sections(text_processor):
     """Test text chunking with section metadata"""
     document = {
         'title': 'Test Document',
@@ -63,7 +61,21 @@ def test_text_chunking_with_sections():
     assert any(chunk['section'] == 'Symptoms' for chunk in chunks)
 
 
-def test_embedding_generation():
+def test_chunks_truncated_to_metadata_limit(text_processor):
+    """Test a chunk of few but very long tokens is cut to the metadata byte limit"""
+    from services.text_processor import MAX_CHUNK_BYTES
+    
+    # Over-long words are a single [UNK] token each, so a chunk within the
+    # token budget holds far more bytes than the limit
+    long_word = "é" * 200
+    chunks = text_processor.chunk_text(" ".join([long_word] * 400))
+    
+    assert all(len(chunk['text'].encode()) <= MAX_CHUNK_BYTES for chunk in chunks)
+    assert chunks[0]['text'].startswith(f"{long_word} {long_word}")
+    assert len(chunks[0]['text'].encode()) > MAX_CHUNK_BYTES - 2
+
+
+def test_embedding_generation(text_processor):
     """Test embedding generation"""
     text = "Diabetes is a chronic disease."
     embedding = text_processor.create_embedding(text)
@@ -73,29 +85,32 @@ def test_embedding_generation():
     assert all(isinstance(val, float) for val in embedding)
 
 
-def test_embedding_empty_text():
+def test_embedding_empty_text(text_processor):
     """Test embedding generation with empty text"""
     # The implementation handles empty text gracefully, doesn't raise
     result = text_processor.create_embedding("")
     assert isinstance(result, list) or result is None
 
 
-def test_batch_embeddings():
-    """Test batch embedding generation"""
-    texts = [
+@pytest.mark.parametrize("texts", [
+    ["Diabetes is a chronic disease."],
+    [
         "Diabetes symptoms include thirst.",
         "Hypertension is high blood pressure.",
         "Medical conditions require treatment."
     ]
+])
+def test_batch_embeddings(text_processor, texts):
+    """Test batch embedding generation"""
+    import numpy as np
     
     embeddings = text_processor.create_embeddings_batch(texts)
     
-    assert len(embeddings) == 3
-    assert all(len(emb) == 384 for emb in embeddings)
     assert all(isinstance(emb, list) for emb in embeddings)
+    assert np.asarray(embeddings).shape == (len(texts), 384)
 
 
-def test_chunk_overlap():
+def test_chunk_overlap(text_processor):
     """Test that chunks have proper overlap"""
     text = "Word " * 500  # Create text with 500 words
     chunks = text_processor.chunk_text(text)
@@ -107,7 +122,7 @@ def test_chunk_overlap():
         assert len(chunks) > 1  # Should create multiple chunks
 
 
-def test_doc_id_generation():
+def test_doc_id_generation(text_processor):
     """Test document ID generation"""
     url1 = "https://example.com/article1"
     url2 = "https://example.com/article2"
@@ -123,7 +138,7 @@ def test_doc_id_generation():
     assert id1a != id2
 
 
-def test_process_document():
+def test_process_document(text_processor):
     """Test full document processing"""
     doc = {
         'url': 'https://example.com/diabetes',
@@ -132,10 +147,184 @@ def test_process_document():
         'topic': 'diabetes'
     }
     
-    chunks = text_processor.process_document(doc)
+    import numpy as np
+    from unittest.mock import patch
+    
+    # All chunks of a document are embedded in one batched call
+    with patch.object(
+        text_processor, 'create_embeddings_batch',
+        wraps=text_processor.create_embeddings_batch
+    ) as mock_batch:
+        chunks = text_processor.process_document(doc)
     
     assert len(chunks) > 0
+    assert mock_batch.call_count == 1
     assert all('doc_id' in chunk for chunk in chunks)
-    assert all('embedding' in chunk for chunk in chunks)
+    assert np.asarray([chunk['embedding'] for chunk in chunks]).shape == (len(chunks), 384)
     assert all('text' in chunk for chunk in chunks)
     assert all(chunk['topic'] == 'diabetes' for chunk in chunks)
+
+
+def test_process_documents_bulk(text_processor):
+    """Test bulk processing embeds all documents in a single encode call"""
+    from unittest.mock import patch
+    
+    docs = [
+        {
+            'url': 'https://example.com/diabetes',
+            'title': 'Understanding Diabetes',
+            'content': 'Diabetes is a chronic condition. ' * 50,
+            'topic': 'diabetes'
+        },
+        {
+            'url': 'https://example.com/asthma',
+            'title': 'Asthma',
+            'sections': [
+                {'section': 'Overview', 'content': 'Asthma affects the airways. ' * 50},
+                {'section': 'Symptoms', 'content': 'Wheezing and coughing. ' * 50}
+            ],
+            'topic': 'asthma'
+        }
+    ]
+    
+    with patch.object(
+        text_processor, 'create_embeddings_batch',
+        wraps=text_processor.create_embeddings_batch
+    ) as mock_batch:
+        chunks = text_processor.process_documents_bulk(docs)
+    
+    assert mock_batch.call_count == 1
+    assert len(chunks) == len(mock_batch.call_args[0][0])
+    assert all(len(chunk['embedding']) == 384 for chunk in chunks)
+    assert {chunk['section'] for chunk in chunks} == {'General', 'Overview', 'Symptoms'}
+    
+    asthma_chunks = [c for c in chunks if c['topic'] == 'asthma']
+    assert [c['chunk_index'] for c in asthma_chunks] == list(range(len(asthma_chunks)))
+
+
+def test_embeddings_batch_preserves_order(text_processor):
+    """Test batched embeddings come back in input order despite length sorting"""
+    texts = ["Short.", "A much longer sentence about chronic heart disease. " * 10, "Mid length text."]
+    
+    batch = text_processor.create_embeddings_batch(texts, batch_size=2)
+    
+    assert len(batch) == len(texts)
+    for text, embedding in zip(texts, batch):
+        single = text_processor.create_embedding(text)
+        assert max(abs(a - b) for a, b in zip(single, embedding)) < 1e-4
+
+
+def test_embeddings_batch_as_numpy_matrix(text_processor):
+    """Test batched embeddings can be returned as one float32 matrix"""
+    import numpy as np
+    
+    texts = ["Diabetes affects blood sugar.", "Hypertension is high blood pressure."]
+    embeddings = text_processor.create_embeddings_batch(texts, convert_to_numpy=True)
+    
+    assert isinstance(embeddings, np.ndarray)
+    assert embeddings.shape == (2, 384)
+    assert embeddings.dtype == np.float32
+
+
+def test_embedding_model_quantized_on_cpu():
+    """Test linear layers are swapped for dynamic int8 versions on CPU"""
+    import torch
+    from services.text_processor import TextProcessor
+    
+    model = TextProcessor().embedding_model
+    
+    assert not any(type(m) is torch.nn.Linear for m in model.modules())
+
+
+def test_embedding_model_onnx_backend():
+    """Test the ONNX backend loads the pre-quantized export instead of quantizing in torch"""
+    from unittest.mock import patch
+    from services.text_processor import load_embedding_model, MODEL_NAME
+    
+    with patch('services.text_processor.settings.EMBEDDING_BACKEND', 'onnx'), \
+         patch('services.text_processor.SentenceTransformer') as mock_model, \
+         patch('torch.ao.quantization.quantize_dynamic') as mock_quantize:
+        model, variant = load_embedding_model()
+    
+    mock_model.assert_called_once_with(
+        MODEL_NAME,
+        backend="onnx",
+        model_kwargs={"file_name": "onnx/model_qint8_avx512_vnni.onnx"}
+    )
+    mock_quantize.assert_not_called()
+    assert model is mock_model.return_value
+    assert variant == "onnx:onnx/model_qint8_avx512_vnni.onnx"
+
+
+def test_stream_documents_batches(text_processor):
+    """Test streaming yields embedded chunks in bounded batches"""
+    docs = [
+        {
+            'url': f'https://example.com/article{i}',
+            'title': f'Article {i}',
+            'content': 'Hypertension raises the risk of heart disease. ' * 100,
+            'topic': 'cardiovascular'
+        }
+        for i in range(3)
+    ]
+    
+    batches = list(text_processor.stream_documents(docs, batch_size=4))
+    streamed = [chunk for batch in batches for chunk in batch]
+    
+    assert all(len(batch) <= 4 for batch in batches)
+    assert all('embedding' in chunk for chunk in streamed)
+    assert [c['doc_id'] for c in streamed] == [c['doc_id'] for c in text_processor.process_documents_bulk(docs)]
+
+
+def test_embedding_cache_reuses_vectors(tmp_path, text_processor):
+    """Test repeated chunk texts are served from the embedding cache"""
+    from unittest.mock import patch
+    
+    texts = ["Key facts about malaria.", "Overview of asthma.", "Key facts about malaria."]
+    
+    text_processor.enable_embedding_cache(tmp_path / "embeddings.db")
+    try:
+        with patch.object(
+            text_processor, '_encode_batch',
+            wraps=text_processor._encode_batch
+        ) as mock_encode:
+            first = text_processor.create_embeddings_batch(texts)
+            second = text_processor.create_embeddings_batch(texts)
+        
+        # Duplicates are encoded once, and the second run hits the cache
+        assert mock_encode.call_count == 1
+        assert len(mock_encode.call_args[0][0]) == 2
+        assert len(first) == 3
+        assert max(abs(a - b) for a, b in zip(first[0], second[0])) < 1e-6
+    finally:
+        text_processor.embedding_cache.close()
+        text_processor.embedding_cache = None
+
+
+def test_query_embedding_memoized(text_processor):
+    """Test repeated queries reuse the same embedding"""
+    from unittest.mock import patch
+    
+    with patch.object(
+        text_processor.embedding_model, 'encode',
+        wraps=text_processor.embedding_model.encode
+    ) as mock_encode:
+        first = text_processor.create_embedding("What causes hypertension in adults?")
+        second = text_processor.create_embedding("What causes hypertension in adults?")
+    
+    assert first == second
+    assert first is not second
+    assert mock_encode.call_count == 1
+
+
+def test_chunks_fit_model_window(text_processor):
+    """Test chunks are sized in tokens and fit the embedding model window"""
+    long_text = "\n\n".join(
+        " ".join(["Hypertension is a serious medical condition."] * 20) for _ in range(10)
+    )
+    chunks = text_processor.chunk_text(long_text)
+    tokenizer = text_processor.embedding_model.tokenizer
+    limit = text_processor.embedding_model.max_seq_length - 2
+    
+    assert len(chunks) > 1
+    assert all(len(tokenizer.tokenize(c['text'])) <= limit for c in chunks)
@@ -6,12 +6,13 @@ from unittest.mock import MagicMock, patch, AsyncMock
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from services.vector_store import VectorDatabase
+from config import settings
 
 
 def test_vector_store_initialization():
     """Test vector store initialization"""
     with patch('pinecone.Pinecone') as mock_pinecone:
-        mock_pinecone.return_value.Index.return_value = MagicMock()
+        mock_pinecone.return_value.index.return_value = MagicMock()
         
         vector_store = VectorDatabase()
         
@@ -22,7 +23,8 @@ def test_upsert_documents():
     """Test upserting documents to vector store"""
     with patch('pinecone.Pinecone') as mock_pinecone:
         mock_index = MagicMock()
-        mock_pinecone.return_value.Index.return_value = mock_index
+        mock_index.upsert.return_value = MagicMock(has_errors=False)
+        mock_pinecone.return_value.index.return_value = mock_index
         
         vector_store = VectorDatabase()
         vector_store.index = mock_index  # Set index to prevent create_index() call
@@ -43,8 +45,20 @@ def test_upsert_documents():
         
         vector_store.upsert_documents(chunks)
         
-        # Verify upsert was called
+        # Verify upsert was called with (id, values, metadata) vectors
         assert mock_index.upsert.called
+        vector_id, values, metadata = mock_index.upsert.call_args[1]['vectors'][0]
+        assert vector_id == 'chunk1'
+        assert len(values) == 384
+        assert metadata['text'] == 'Diabetes is a chronic disease.'
+        assert metadata['section'] == 'Introduction'
+        
+        # gRPC sends float32 either way, so values are only quantized for JSON bodies
+        assert values.tolist() == [0.1] * 384
+        with patch.object(settings, 'PINECONE_USE_GRPC', False):
+            vector_store.upsert_documents(chunks)
+        _, values, _ = mock_index.upsert.call_args[1]['vectors'][0]
+        assert set(values.tolist()) == {127}
 
 
 def test_search_vectors():
@@ -57,7 +71,7 @@ def test_search_vectors():
                 {'id': 'chunk2', 'score': 0.85, 'metadata': {}}
             ]
         }
-        mock_pinecone.return_value.Index.return_value = mock_index
+        mock_pinecone.return_value.index.return_value = mock_index
         
         vector_store = VectorDatabase()
         
@@ -88,7 +102,7 @@ def test_search_with_section_filter():
                 }
             ]
         }
-        mock_pinecone.return_value.Index.return_value = mock_index
+        mock_pinecone.return_value.index.return_value = mock_index
         
         vector_store = VectorDatabase()
         vector_store.index = mock_index
@@ -100,13 +114,14 @@ def test_search_with_section_filter():
         assert results is not None
         assert len(results) > 0
         assert results[0]['section'] == 'Symptoms'
+        assert mock_index.query.call_args[1]['filter'] == {'section': 'Symptoms'}
 
 
 def test_delete_by_metadata():
     """Test deleting vectors by metadata"""
     with patch('pinecone.Pinecone') as mock_pinecone:
         mock_index = MagicMock()
-        mock_pinecone.return_value.Index.return_value = mock_index
+        mock_pinecone.return_value.index.return_value = mock_index
         
         vector_store = VectorDatabase()
         
@@ -124,7 +139,7 @@ def test_get_index_stats():
             'index_fullness': 0.1,
             'total_vector_count': 1000
         }
-        mock_pinecone.return_value.Index.return_value = mock_index
+        mock_pinecone.return_value.index.return_value = mock_index
         
         vector_store = VectorDatabase()
         
@@ -137,7 +152,8 @@ def test_batch_upsert():
     """Test batch upserting of documents"""
     with patch('pinecone.Pinecone') as mock_pinecone:
         mock_index = MagicMock()
-        mock_pinecone.return_value.Index.return_value = mock_index
+        mock_index.upsert.return_value = MagicMock(has_errors=False)
+        mock_pinecone.return_value.index.return_value = mock_index
         
         vector_store = VectorDatabase()
         # Manually set index to avoid create_index() call
@@ -163,6 +179,149 @@ def test_batch_upsert():
         
         # Should handle batching
         assert mock_index.upsert.called
+        assert mock_index.upsert.call_args[1]['batch_size'] == 64
+        assert mock_index.upsert.call_args[1]['max_concurrency'] == 30
+
+
+@pytest.mark.parametrize("use_grpc", [True, False], ids=["grpc", "rest"])
+def test_upsert_batches_fit_request_cap(use_grpc):
+    """Test chunks with large metadata are sent in smaller batches under 2 MB"""
+    import numpy as np
+    import orjson
+    from services.vector_store import MAX_UPSERT_REQUEST_BYTES
+    
+    vector_store = VectorDatabase()
+    vector_store.index = MagicMock()
+    vector_store.index.upsert.return_value = MagicMock(has_errors=False)
+    
+    chunks = [
+        {
+            'doc_id': f'chunk{i}',
+            'text': 'x' * 35000,
+            'embedding': [0.123456789] * 384,
+            'source_url': 'https://test.com',
+            'title': f'Doc {i}',
+            'topic': 'general',
+            'chunk_index': i
+        }
+        for i in range(100)
+    ]
+    
+    with patch.object(settings, 'PINECONE_USE_GRPC', use_grpc):
+        vector_store.upsert_documents(chunks)
+    
+    kwargs = vector_store.index.upsert.call_args.kwargs
+    vector_id, values, metadata = kwargs['vectors'][0]
+    if use_grpc:
+        # Packed float32 values, unquantized since int8 saves nothing on the wire
+        assert values.dtype != np.int8
+        record_bytes = len(vector_id) + 4 * len(values) + len(orjson.dumps(metadata))
+    else:
+        record_bytes = len(orjson.dumps({'id': vector_id, 'values': values.tolist(), 'metadata': metadata}))
+    
+    assert kwargs['batch_size'] < settings.PINECONE_UPSERT_BATCH_SIZE
+    assert kwargs['batch_size'] * record_bytes <= MAX_UPSERT_REQUEST_BYTES
+
+
+def test_create_index_backs_off_until_ready():
+    """Test index readiness is polled with growing delays"""
+    vector_store = VectorDatabase()
+    vector_store.pc = MagicMock()
+    vector_store.pc.list_indexes.return_value = []
+    vector_store.pc.describe_index.side_effect = [
+        MagicMock(status={'ready': False}),
+        MagicMock(status={'ready': False}),
+        MagicMock(status={'ready': True})
+    ]
+    
+    with patch('services.vector_store.time.sleep') as mock_sleep:
+        vector_store.create_index()
+    
+    assert [c[0][0] for c in mock_sleep.call_args_list] == [0.05, 0.1]
+    assert vector_store.index is not None
+    vector_store.pc.index.assert_called_once_with(name=settings.PINECONE_INDEX_NAME, grpc=True)
+
+
+def test_create_index_times_out():
+    """Test index creation gives up once the readiness timeout passes"""
+    vector_store = VectorDatabase()
+    vector_store.pc = MagicMock()
+    vector_store.pc.list_indexes.return_value = []
+    vector_store.pc.describe_index.return_value = MagicMock(status={'ready': False})
+    
+    with patch.object(settings, 'PINECONE_INDEX_READY_TIMEOUT', 0), \
+         patch('services.vector_store.time.sleep'):
+        with pytest.raises(TimeoutError):
+            vector_store.create_index()
+
+
+def test_quantize_int8_preserves_direction():
+    """Test int8 values keep cosine similarity with the original embedding"""
+    import numpy as np
+    from services.vector_store import quantize_int8
+    
+    embedding = np.random.default_rng(0).normal(size=384).astype(np.float32)
+    quantized = quantize_int8(embedding)
+    
+    assert quantized.dtype == np.int8
+    assert np.abs(quantized).max() == 127
+    cosine = np.dot(embedding, quantized) / (np.linalg.norm(embedding) * np.linalg.norm(quantized))
+    assert cosine > 0.999
+
+
+def test_upsert_groups_large_ingests():
+    """Test large ingests are sent in bounded groups"""
+    vector_store = VectorDatabase()
+    vector_store.index = MagicMock()
+    vector_store.index.upsert.return_value = MagicMock(has_errors=False)
+    
+    # Chunks may be a lazy iterable; vectors are built one group at a time
+    chunks = (
+        {
+            'doc_id': f'chunk{i}',
+            'text': f'Text {i}',
+            'embedding': [0.1] * 384,
+            'source_url': 'https://test.com',
+            'title': f'Doc {i}',
+            'topic': 'general',
+            'chunk_index': i
+        }
+        for i in range(2500)
+    )
+    
+    vector_store.upsert_documents(chunks)
+    
+    group_sizes = [len(c[1]['vectors']) for c in vector_store.index.upsert.call_args_list]
+    assert group_sizes == [1000, 1000, 500]
+
+
+def test_upsert_retries_failed_vectors():
+    """Test vectors from failed batches are retried once"""
+    vector_store = VectorDatabase()
+    vector_store.index = MagicMock()
+    
+    chunks = [
+        {
+            'doc_id': f'chunk{i}',
+            'text': f'Text {i}',
+            'embedding': [0.1] * 384,
+            'source_url': 'https://test.com',
+            'title': f'Doc {i}',
+            'topic': 'general',
+            'chunk_index': i
+        }
+        for i in range(3)
+    ]
+    failed = [{'id': 'chunk2', 'values': [0.1] * 384}]
+    vector_store.index.upsert.side_effect = [
+        MagicMock(has_errors=True, failed_items=failed),
+        MagicMock(has_errors=False)
+    ]
+    
+    vector_store.upsert_documents(chunks)
+    
+    assert vector_store.index.upsert.call_count == 2
+    assert vector_store.index.upsert.call_args[1]['vectors'] == failed
 
 
 def test_search_with_top_k():
@@ -175,7 +334,7 @@ def test_search_with_top_k():
                 for i in range(10)
             ]
         }
-        mock_pinecone.return_value.Index.return_value = mock_index
+        mock_pinecone.return_value.index.return_value = mock_index
         
         vector_store = VectorDatabase()
         
@@ -191,7 +350,7 @@ def test_empty_search_results():
     with patch('services.vector_store.Pinecone') as mock_pinecone:
         mock_index = MagicMock()
         mock_index.query.return_value = {'matches': []}
-        mock_pinecone.return_value.Index.return_value = mock_index
+        mock_pinecone.return_value.index.return_value = mock_index
         
         # Create new instance with mocked Pinecone
         from services.vector_store import VectorDatabase
@@ -208,3 +367,112 @@ def test_empty_search_results():
         results = vector_store.search(query_embedding, top_k=3)
         
         assert results == [] or results is None
+
+
+def test_search_cache_reuses_results_for_similar_queries():
+    """Test near-identical queries are served from the search cache"""
+    vector_store = VectorDatabase()
+    vector_store.index = MagicMock()
+    vector_store.index.query.return_value = {
+        'matches': [
+            {
+                'id': 'chunk1',
+                'score': 0.9,
+                'metadata': {
+                    'text': 'Diabetes text',
+                    'source_url': 'https://test.com',
+                    'title': 'Diabetes',
+                    'topic': 'general'
+                }
+            }
+        ]
+    }
+    
+    first = vector_store.search([0.1] * 384, top_k=3)
+    second = vector_store.search([0.1] * 383 + [0.11], top_k=3)
+    
+    assert second == first
+    assert vector_store.index.query.call_count == 1
+    
+    # Different search arguments or dissimilar embeddings go to Pinecone
+    vector_store.search([0.1] * 384, top_k=5)
+    vector_store.search([0.1] * 192 + [-0.1] * 192, top_k=3)
+    assert vector_store.index.query.call_count == 3
+
+
+def test_search_cache_evicts_least_recently_used():
+    """Test the search cache evicts the least recently used entry when full"""
+    import numpy as np
+    from services.vector_store import SearchCache
+    
+    cache = SearchCache(maxsize=2, dimension=3, threshold=0.95)
+    cache.put([1, 0, 0], (5, None, None), ['a'])
+    cache.put([0, 1, 0], (5, None, None), ['b'])
+    
+    # Touch 'a' so 'b' becomes least recently used
+    assert cache.get([1, 0, 0], (5, None, None)) == ['a']
+    cache.put([0, 0, 1], (5, None, None), ['c'])
+    
+    assert cache.get([0, 1, 0], (5, None, None)) is None
+    assert cache.get([1, 0, 0], (5, None, None)) == ['a']
+    assert cache.get([0, 0, 1], (5, None, None)) == ['c']
+
+
+def test_index_connected_once_under_concurrent_use():
+    """Test concurrent first searches connect to the index only once"""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    
+    vector_store = VectorDatabase()
+    
+    def slow_create_index():
+        time.sleep(0.05)
+        vector_store.index = MagicMock()
+    
+    with patch.object(vector_store, 'create_index', side_effect=slow_create_index) as mock_create:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: vector_store._ensure_index(), range(4)))
+    
+    assert mock_create.call_count == 1
+
+
+def test_search_batch():
+    """Test batched searches query Pinecone once per embedding and keep input order"""
+    import numpy as np
+    
+    vector_store = VectorDatabase()
+    vector_store.index = MagicMock()
+    vector_store.index.query.side_effect = lambda vector, **kwargs: {
+        'matches': [
+            {
+                'id': f'chunk{int(np.argmax(vector))}',
+                'score': 0.9,
+                'metadata': {
+                    'text': 'Diabetes text',
+                    'source_url': 'https://test.com',
+                    'title': 'Diabetes',
+                    'topic': 'general'
+                }
+            }
+        ]
+    }
+    
+    # One-hot queries are dissimilar, so none is served from the search cache
+    results = vector_store.search_batch(np.eye(4, 384, dtype=np.float32), top_k=3)
+    
+    assert vector_store.index.query.call_count == 4
+    assert [matches[0]['id'] for matches in results] == ['chunk0', 'chunk1', 'chunk2', 'chunk3']
+
+
+def test_close_releases_connections():
+    """Test closing shuts down the query threads and index connection"""
+    vector_store = VectorDatabase()
+    index = vector_store.index = MagicMock()
+    executor = vector_store.query_executor
+    
+    vector_store.close()
+    
+    index.close.assert_called_once()
+    assert vector_store.index is None
+    assert executor._shutdown
+    assert vector_store.query_executor is not executor
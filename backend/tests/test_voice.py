@@ -6,17 +6,28 @@ from io import BytesIO
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from services.voice import VoiceService
+from services.voice import VoiceService, load_piper_voice, load_whisper_model
+
+
+@pytest.fixture(autouse=True)
+def fresh_models():
+    """Tests patch the model loaders, so never reuse a model loaded by another test"""
+    load_whisper_model.cache_clear()
+    load_piper_voice.cache_clear()
+    yield
+    load_whisper_model.cache_clear()
+    load_piper_voice.cache_clear()
 
 
 @pytest.mark.asyncio
 async def test_transcribe_audio():
     """Test audio transcription with Whisper"""
-    with patch('whisper.load_model') as mock_whisper:
+    with patch('services.voice.WhisperModel') as mock_whisper:
         mock_model = MagicMock()
-        mock_model.transcribe.return_value = {
-            'text': 'What are the symptoms of diabetes?'
-        }
+        mock_model.transcribe.return_value = (
+            iter([MagicMock(text=' What are the symptoms'), MagicMock(text=' of diabetes?')]),
+            MagicMock(language='en')
+        )
         mock_whisper.return_value = mock_model
         
         voice_service = VoiceService()
@@ -27,6 +38,12 @@ async def test_transcribe_audio():
         result = voice_service.transcribe_audio(audio_data)
         
         assert result['text'] == 'What are the symptoms of diabetes?'
+        assert mock_model.transcribe.call_args[1]['vad_filter'] is True
+        
+        # The model is loaded once with parallel workers for concurrent requests
+        voice_service.transcribe_audio(audio_data)
+        mock_whisper.assert_called_once()
+        assert mock_whisper.call_args[1]['num_workers'] >= 1
 
 
 @pytest.mark.asyncio
@@ -46,12 +63,50 @@ async def test_text_to_speech():
         assert '.mp3' in audio_path or 'audio' in audio_path
 
 
+def test_text_to_speech_uses_local_piper_voice():
+    """Test local Piper synthesis writes a WAV without calling gTTS"""
+    voice_service = VoiceService()
+    
+    def synthesize_wav(text, wav_file):
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(22050)
+        wav_file.writeframes(b'\x00\x00' * 10)
+    
+    mock_voice = MagicMock()
+    mock_voice.synthesize_wav.side_effect = synthesize_wav
+    voice_service.piper_voice = mock_voice
+    
+    with patch('services.voice.gTTS') as mock_gtts:
+        audio_path = voice_service.text_to_speech("Drink plenty of water.", "session-piper")
+    
+    assert audio_path.endswith(".wav")
+    mock_gtts.assert_not_called()
+    os.unlink(audio_path.lstrip("/"))
+
+
+def test_text_to_speech_reuses_audio_for_identical_text():
+    """Test repeated text is served from the existing audio file"""
+    voice_service = VoiceService()
+    voice_service.piper_voice = None
+    
+    with patch('services.voice.gTTS') as mock_gtts:
+        mock_gtts.return_value.save.side_effect = lambda path: open(path, 'wb').write(b'fake audio')
+        
+        first = voice_service.text_to_speech("Call emergency services now.", "session-a")
+        second = voice_service.text_to_speech("Call emergency services now.", "session-b")
+    
+    assert first == second
+    assert mock_gtts.call_count == 1
+    os.unlink(first.lstrip("/"))
+
+
 @pytest.mark.asyncio
 async def test_transcribe_empty_audio():
     """Test transcription with empty audio"""
-    with patch('whisper.load_model') as mock_whisper:
+    with patch('services.voice.WhisperModel') as mock_whisper:
         mock_model = MagicMock()
-        mock_model.transcribe.return_value = {'text': ''}
+        mock_model.transcribe.return_value = (iter([]), MagicMock(language='en'))
         mock_whisper.return_value = mock_model
         
         voice_service = VoiceService()
@@ -64,6 +119,97 @@ async def test_transcribe_empty_audio():
         assert result['text'] == '' or result is None
 
 
+def test_render_failure_is_recorded():
+    """Test a failed synthesis marks its audio URL failed until a render succeeds"""
+    voice_service = VoiceService()
+    voice_service.piper_voice = None
+    audio_url = voice_service.speech_url("Rest and drink fluids.")
+    
+    with patch('services.voice.gTTS') as mock_gtts:
+        mock_gtts.return_value.save.side_effect = Exception("No network")
+        with pytest.raises(Exception):
+            voice_service.render_speech("Rest and drink fluids.", audio_url)
+        
+        # Recorded on disk, so other workers see it too, and forgotten after the TTL
+        assert VoiceService().audio_status(audio_url) == "failed"
+        with patch('services.voice.settings.AUDIO_FAILURE_TTL', 0):
+            assert voice_service.audio_status(audio_url) == "pending"
+        
+        mock_gtts.return_value.save.side_effect = lambda path: open(path, 'wb').write(b'fake audio')
+        voice_service.render_speech("Rest and drink fluids.", audio_url)
+    
+    assert voice_service.audio_status(audio_url) == "ready"
+    assert not os.path.exists(audio_url.lstrip("/") + ".failed")
+    os.unlink(audio_url.lstrip("/"))
+
+
+def test_audio_cache_evicts_least_recently_used(tmp_path):
+    """Test the audio cache keeps only the most recently used files"""
+    for age, name in enumerate(["old.mp3", "used.mp3", "new.mp3"]):
+        path = tmp_path / name
+        path.write_bytes(b'fake audio')
+        os.utime(path, (age, age))
+    
+    # A cache hit refreshes the file, so it outlives newer but unused ones
+    os.utime(tmp_path / "used.mp3")
+    VoiceService.evict_audio_cache(str(tmp_path), max_files=2)
+    
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["new.mp3", "used.mp3"]
+
+
+def test_audio_cache_eviction_drops_expired_failure_markers(tmp_path):
+    """Test failure markers aren't counted as audio and expire with the TTL"""
+    (tmp_path / "a.mp3").write_bytes(b'fake audio')
+    (tmp_path / "b.mp3.failed").touch()
+    stale = tmp_path / "c.mp3.failed"
+    stale.touch()
+    os.utime(stale, (0, 0))
+    
+    VoiceService.evict_audio_cache(str(tmp_path), max_files=1)
+    
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.mp3", "b.mp3.failed"]
+
+
+def test_audio_cache_eviction_skips_vanished_files(tmp_path):
+    """Test files unlinked by a concurrent eviction after the listing are skipped"""
+    from contextlib import contextmanager
+    
+    for age, name in enumerate(["a.mp3", "b.mp3", "c.mp3", "d.mp3"]):
+        path = tmp_path / name
+        path.write_bytes(b'fake audio')
+        os.utime(path, (age, age))
+    
+    real_scandir = os.scandir
+    
+    @contextmanager
+    def racing_scandir(path):
+        with real_scandir(path) as entries:
+            listed = list(entries)
+        # Another worker evicts a file between the listing and the stat
+        os.unlink(tmp_path / "a.mp3")
+        yield iter(listed)
+    
+    with patch('services.voice.os.scandir', racing_scandir):
+        VoiceService.evict_audio_cache(str(tmp_path), max_files=2)
+    
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["c.mp3", "d.mp3"]
+
+
+def test_eviction_error_does_not_fail_render():
+    """Test a successful render stays successful when cache eviction fails"""
+    voice_service = VoiceService()
+    voice_service.piper_voice = None
+    audio_url = voice_service.speech_url("Take the full course of antibiotics.")
+    
+    with patch('services.voice.gTTS') as mock_gtts, \
+         patch.object(VoiceService, 'evict_audio_cache', side_effect=OSError("Disk busy")):
+        mock_gtts.return_value.save.side_effect = lambda path: open(path, 'wb').write(b'fake audio')
+        voice_service.render_speech("Take the full course of antibiotics.", audio_url)
+    
+    assert voice_service.audio_status(audio_url) == "ready"
+    os.unlink(audio_url.lstrip("/"))
+
+
 @pytest.mark.asyncio
 async def test_tts_long_text():
     """Test TTS with long text"""
@@ -84,12 +230,12 @@ async def test_tts_long_text():
 @pytest.mark.asyncio
 async def test_whisper_language_detection():
     """Test Whisper language detection"""
-    with patch('whisper.load_model') as mock_whisper:
+    with patch('services.voice.WhisperModel') as mock_whisper:
         mock_model = MagicMock()
-        mock_model.transcribe.return_value = {
-            'text': 'Hello',
-            'language': 'en'
-        }
+        mock_model.transcribe.return_value = (
+            iter([MagicMock(text=' Hello')]),
+            MagicMock(language='en')
+        )
         mock_whisper.return_value = mock_model
         
         voice_service = VoiceService()
@@ -139,7 +285,7 @@ async def test_tts_file_creation():
 @pytest.mark.asyncio
 async def test_transcribe_handles_errors():
     """Test transcription error handling"""
-    with patch('whisper.load_model') as mock_whisper:
+    with patch('services.voice.WhisperModel') as mock_whisper:
         mock_model = MagicMock()
         mock_model.transcribe.side_effect = Exception("Transcription failed")
         mock_whisper.return_value = mock_model
@@ -154,3 +300,80 @@ async def test_transcribe_handles_errors():
             assert result is None or result == ""
         except Exception as e:
             assert "Transcription failed" in str(e)
+
+
+def test_convert_audio_format_streams_through_ffmpeg():
+    """Test audio conversion shells out to ffmpeg with a 16 kHz mono resample"""
+    with patch('services.voice.subprocess.run') as mock_run:
+        output_path = VoiceService.convert_audio_format("clip.webm")
+    
+    command = mock_run.call_args[0][0]
+    assert command[0] == "ffmpeg"
+    assert command[-1] == output_path
+    assert command[command.index("-ar") + 1] == "16000"
+    assert command[command.index("-ac") + 1] == "1"
+    os.unlink(output_path)
+
+
+def test_torch_feature_extractor_matches_numpy():
+    """Test torch log-mel features match faster-whisper's NumPy extractor"""
+    import numpy as np
+    from faster_whisper.feature_extractor import FeatureExtractor
+    from services.voice import TorchFeatureExtractor
+    
+    waveform = np.random.default_rng(0).uniform(-0.5, 0.5, 16000).astype(np.float32)
+    
+    expected = FeatureExtractor()(waveform)
+    actual = TorchFeatureExtractor()(waveform)
+    
+    assert actual.shape == expected.shape
+    assert np.allclose(actual, expected, atol=1e-4)
+
+
+def test_whisper_model_shared_across_services():
+    """Test every voice service reuses one loaded Whisper model"""
+    with patch('services.voice.WhisperModel') as mock_whisper:
+        mock_whisper.return_value.feat_kwargs = {}
+        
+        models = {id(VoiceService().whisper_model) for _ in range(3)}
+    
+    assert len(models) == 1
+    mock_whisper.assert_called_once()
+
+
+def test_piper_voice_loaded_once_under_concurrent_use(tmp_path):
+    """Test concurrent first reads of the Piper voice share a single load"""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    
+    voice_path = tmp_path / "voice.onnx"
+    voice_path.touch()
+    
+    def slow_load(*args, **kwargs):
+        time.sleep(0.05)
+        return MagicMock()
+    
+    with patch('services.voice.settings.USE_LOCAL_TTS', True), \
+         patch('services.voice.settings.PIPER_VOICE_PATH', voice_path), \
+         patch('services.voice.PiperVoice.load', side_effect=slow_load) as mock_load:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            voices = list(executor.map(lambda _: VoiceService().piper_voice, range(4)))
+    
+    mock_load.assert_called_once()
+    assert len({id(voice) for voice in voices}) == 1
+
+
+def test_warmup_runs_a_transcription():
+    """Test warmup loads Whisper and decodes one second of silence"""
+    with patch('services.voice.WhisperModel') as mock_whisper:
+        mock_model = MagicMock()
+        mock_model.feat_kwargs = {}
+        mock_model.transcribe.return_value = (iter([]), MagicMock(language='en'))
+        mock_whisper.return_value = mock_model
+        
+        voice_service = VoiceService()
+        voice_service.warmup()
+        
+        audio = mock_model.transcribe.call_args[0][0]
+        assert len(audio) == 16000
+        assert not audio.any()
@@ -4,21 +4,59 @@ import drAshaAvatar from '@/assets/dr-asha-avatar.png';
 import { cn } from '@/lib/utils';
 import { Button } from '@/components/ui/button';
 import { useState, useRef } from 'react';
+import { API_BASE_URL } from '@/hooks/useChat';
 
 interface MessageBubbleProps {
   message: Message;
 }
 
+// Reply audio is synthesized after the response is sent; poll until it is ready
+const AUDIO_POLL_INTERVAL_MS = 500;
+const AUDIO_POLL_ATTEMPTS = 30;
+
+const audioStatusUrl = (audioUrl: string): string => {
+  const fileName = new URL(audioUrl).pathname.split('/').pop();
+  return `${API_BASE_URL}/api/chat/voice/audio/${fileName}`;
+};
+
+const waitForAudio = async (audioUrl: string): Promise<boolean> => {
+  for (let attempt = 0; attempt < AUDIO_POLL_ATTEMPTS; attempt++) {
+    try {
+      const response = await fetch(audioStatusUrl(audioUrl));
+      if (response.ok) {
+        const { status } = await response.json();
+        if (status === 'ready') return true;
+        if (status === 'failed') return false;
+      }
+    } catch (err) {
+      console.error('Error checking audio status:', err);
+    }
+    await new Promise((resolve) => setTimeout(resolve, AUDIO_POLL_INTERVAL_MS));
+  }
+  return false;
+};
+
 export function MessageBubble({ message }: MessageBubbleProps) {
   const isUser = message.role === 'user';
   const isLowConfidence = message.confidence !== undefined && message.confidence < 0.7;
   const [isPlayingAudio, setIsPlayingAudio] = useState(false);
+  const [isLoadingAudio, setIsLoadingAudio] = useState(false);
+  const [audioUnavailable, setAudioUnavailable] = useState(false);
   const audioRef = useRef<HTMLAudioElement | null>(null);
 
-  const playAudio = () => {
+  const playAudio = async () => {
     if (!message.audioUrl) return;
     
     if (!audioRef.current) {
+      setIsLoadingAudio(true);
+      const ready = await waitForAudio(message.audioUrl);
+      setIsLoadingAudio(false);
+      
+      if (!ready) {
+        setAudioUnavailable(true);
+        return;
+      }
+      
       audioRef.current = new Audio(message.audioUrl);
       audioRef.current.onended = () => setIsPlayingAudio(false);
       audioRef.current.onerror = () => {
@@ -88,17 +126,21 @@ export function MessageBubble({ message }: MessageBubbleProps) {
             )}>
               <Mic className="h-3 w-3" />
               <span>Voice message</span>
-              {!isUser && message.audioUrl && (
+              {!isUser && message.audioUrl && audioUnavailable && (
+                <span className="ml-auto">Audio unavailable</span>
+              )}
+              {!isUser && message.audioUrl && !audioUnavailable && (
                 <div className="ml-auto flex gap-1">
                   {!isPlayingAudio ? (
                     <Button
                       variant="ghost"
                       size="sm"
                       onClick={playAudio}
+                      disabled={isLoadingAudio}
                       className="h-6 px-2 text-xs"
                     >
                       <Volume2 className="h-3 w-3 mr-1" />
-                      Play
+                      {isLoadingAudio ? 'Loading' : 'Play'}
                     </Button>
                   ) : (
                     <Button
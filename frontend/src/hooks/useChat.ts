@@ -2,7 +2,7 @@ import { useState, useCallback } from 'react';
 import { Message } from '@/lib/types';
 import { v4 as uuidv4 } from 'uuid';
 
-const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000';
+export const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000';
 
 interface Source {
   url: string;
@@ -38,7 +38,7 @@ export function useChat() {
     setIsLoading(true);
 
     try {
-      const response = await fetch(`${API_BASE_URL}/api/chat/text`, {
+      const response = await fetch(`${API_BASE_URL}/api/chat/text/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -49,23 +49,69 @@ export function useChat() {
         }),
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
-      const data = await response.json();
-      
-      const assistantMessage: Message = {
-        id: uuidv4(),
-        role: 'assistant',
-        content: data.response,
-        timestamp: new Date(),
-        sources: data.sources?.map((s: Source) => s.url) || [],
-        confidence: data.confidence,
-        cached: data.cached || false,
+      // The response arrives as newline-delimited JSON events:
+      // sources, then text deltas, then done with the full response
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      const assistantId = uuidv4();
+      let buffer = '';
+      let text = '';
+      let sources: string[] = [];
+      let confidence = 0;
+      let cached = false;
+      let started = false;
+
+      const render = () => {
+        const assistantMessage: Message = {
+          id: assistantId,
+          role: 'assistant',
+          content: text,
+          timestamp: new Date(),
+          sources,
+          confidence,
+          cached,
+        };
+
+        if (!started) {
+          started = true;
+          setMessages(prev => [...prev, assistantMessage]);
+        } else {
+          setMessages(prev => prev.map(m => (m.id === assistantId ? assistantMessage : m)));
+        }
       };
 
-      setMessages(prev => [...prev, assistantMessage]);
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop() ?? '';
+
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          const event = JSON.parse(line);
+
+          if (event.type === 'sources') {
+            sources = event.sources?.map((s: Source) => s.url) || [];
+            confidence = event.confidence;
+          } else if (event.type === 'delta') {
+            text += event.delta;
+            render();
+          } else if (event.type === 'done') {
+            text = event.response;
+            confidence = event.confidence;
+            cached = event.cached || false;
+            render();
+          } else if (event.type === 'error') {
+            throw new Error(event.detail);
+          }
+        }
+      }
     } catch (error) {
       console.error('Error sending message:', error);
       